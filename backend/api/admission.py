@@ -0,0 +1,193 @@
+import math
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Admission control in front of a model: at most `max_in_flight` requests run
+# inference at once, the rest wait in a bounded priority queue. Interactive
+# requests go ahead of bulk ones, and within a class the earliest deadline goes
+# first. Requests that can no longer meet their deadline are dropped before
+# they reach the model, and a full queue is answered immediately so the client
+# can back off instead of timing out.
+
+INTERACTIVE = 0
+BULK        = 1
+PRIORITIES  = {"interactive": INTERACTIVE, "bulk": BULK}
+
+
+class Overloaded(Exception):
+    """The request was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Overloaded):
+    """The request's deadline passed (or would pass) before it could reach the model."""
+
+
+class _Waiter:
+    __slots__ = ("event", "outcome")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.outcome = None   # "granted" | "evicted" | "expired", set under the controller lock
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_in_flight: int = 2, max_queue: int = 16,
+                 initial_service_s: float = 1.0, window: int = 1000):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._queue = []               # heap of (priority, deadline, seq, waiter)
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._service_s = initial_service_s   # EWMA of time spent holding a slot
+        self._waits = deque(maxlen=window)    # recent queue wait times (s) of admitted requests
+        self._counters = {
+            "admitted": 0,
+            "completed": 0,
+            "shed_overloaded": 0,
+            "shed_deadline": 0,
+            "evicted": 0,
+        }
+
+    # ─── Public API ──────────────────────────────────────────────────────────
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, deadline: float = None):
+        """Hold an inference slot for the duration of the block.
+
+        `deadline` is an absolute time.monotonic() value. Raises Overloaded when
+        the queue is full and DeadlineExceeded when the deadline cannot be met.
+        """
+        waited = self._acquire(priority, math.inf if deadline is None else deadline)
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self._release(time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": len(self._queue),
+                "queue_depth_bulk": sum(1 for e in self._queue if e[0] == BULK),
+                "max_queue": self.max_queue,
+                "service_s_ewma": round(self._service_s, 4),
+                "wait_s_p50": round(waits[len(waits) // 2], 4) if waits else 0.0,
+                "wait_s_p95": round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0,
+                "wait_s_max": round(waits[-1], 4) if waits else 0.0,
+                **self._counters,
+            }
+
+    # ─── Internals (call with self._lock held unless noted) ──────────────────
+    def _retry_after(self) -> float:
+        return max(1.0, math.ceil((len(self._queue) + 1) / self.max_in_flight * self._service_s))
+
+    def _expected_wait(self, ahead: int) -> float:
+        if self._in_flight < self.max_in_flight and ahead == 0:
+            return 0.0
+        return (ahead + 1) / self.max_in_flight * self._service_s
+
+    def _shed(self, counter: str, exc):
+        self._counters[counter] += 1
+        raise exc
+
+    def _acquire(self, priority: int, deadline: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if deadline <= now:
+                self._shed("shed_deadline", DeadlineExceeded("Deadline already expired", self._retry_after()))
+
+            if self._in_flight < self.max_in_flight and not self._queue:
+                self._in_flight += 1
+                self._counters["admitted"] += 1
+                self._waits.append(0.0)
+                return 0.0
+
+            ahead = sum(1 for p, d, _, _ in self._queue if (p, d) <= (priority, deadline))
+            if now + self._expected_wait(ahead) > deadline:
+                self._shed("shed_deadline", DeadlineExceeded(
+                    f"{self.name} cannot start before the request deadline", self._retry_after()))
+
+            if len(self._queue) >= self.max_queue and not self._evict_for(priority):
+                self._shed("shed_overloaded", Overloaded(f"{self.name} is saturated", self._retry_after()))
+
+            waiter = _Waiter()
+            heapq.heappush(self._queue, (priority, deadline, next(self._seq), waiter))
+
+        timeout = None if deadline == math.inf else max(0.0, deadline - time.monotonic())
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if waiter.outcome == "granted":
+                if deadline <= time.monotonic():
+                    # Timed out, but a release granted the slot before we got the lock back:
+                    # hand it on rather than run past the deadline
+                    self._in_flight -= 1
+                    self._counters["admitted"] -= 1
+                    self._counters["shed_deadline"] += 1
+                    self._dispatch()
+                    raise DeadlineExceeded(f"Deadline expired while queued for {self.name}", self._retry_after())
+                waited = time.monotonic() - now
+                self._waits.append(waited)
+                return waited
+            if waiter.outcome == "evicted":
+                raise Overloaded(f"{self.name} is saturated", self._retry_after())
+            if waiter.outcome is None:
+                # Timed out in the queue
+                self._remove(waiter)
+                self._counters["shed_deadline"] += 1
+            raise DeadlineExceeded(f"Deadline expired while queued for {self.name}", self._retry_after())
+
+    def _evict_for(self, priority: int) -> bool:
+        """Make room for an interactive request by dropping the queued bulk request with the latest deadline."""
+        if priority != INTERACTIVE:
+            return False
+        bulk = [e for e in self._queue if e[0] == BULK]
+        if not bulk:
+            return False
+        victim = max(bulk, key=lambda e: (e[1], e[2]))
+        self._queue.remove(victim)
+        heapq.heapify(self._queue)
+        victim[3].outcome = "evicted"
+        victim[3].event.set()
+        self._counters["evicted"] += 1
+        self._counters["shed_overloaded"] += 1
+        return True
+
+    def _remove(self, waiter: _Waiter):
+        self._queue = [e for e in self._queue if e[3] is not waiter]
+        heapq.heapify(self._queue)
+
+    def _release(self, held_s: float):
+        with self._lock:
+            self._in_flight -= 1
+            self._counters["completed"] += 1
+            self._service_s = 0.8 * self._service_s + 0.2 * held_s
+            self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to queued requests whose deadline hasn't passed."""
+        now = time.monotonic()
+        while self._queue and self._in_flight < self.max_in_flight:
+            _, deadline, _, waiter = heapq.heappop(self._queue)
+            if deadline <= now:
+                # Expired while queued: wake it so it sheds itself, never hand it the model
+                self._counters["shed_deadline"] += 1
+                waiter.outcome = "expired"
+                waiter.event.set()
+                continue
+            waiter.outcome = "granted"
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            waiter.event.set()
@@ -1,15 +1,22 @@
 import io
+import os
 import json
+import time
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
-from disease_detector_banana import predict_disease_banana
-from disease_detector_tomato import predict_disease_tomato
+from disease_detector_banana import predict_disease_banana, predict_leaves_banana
+from disease_detector_tomato import predict_disease_tomato, predict_leaves_tomato
 from weather_api import get_weather
-from recommender import get_disease_recommendations, generate_recommendations
+from recommender import get_disease_recommendations, generate_recommendations, stream_disease_recommendations
+from jobs import JobQueue
+from admission import AdmissionController, Overloaded, INTERACTIVE, BULK, PRIORITIES
+from streaming import bounded_events
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
@@ -18,6 +25,122 @@ ALLOWED = {'png','jpg','jpeg','bmp','gif'}
 def allowed_file(fn):
     return '.' in fn and fn.rsplit('.',1)[1].lower() in ALLOWED
 
+# one admission controller per model: bounded in-flight inference, priority queue, deadlines
+admission = {
+    name: AdmissionController(
+        name,
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "2")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "16")),
+    )
+    for name in ('banana', 'tomato')
+}
+
+def request_deadline():
+    """Absolute time.monotonic() deadline from the X-Request-Deadline-Ms header (client's budget in ms)."""
+    budget = request.headers.get('X-Request-Deadline-Ms') or os.getenv("ADMISSION_DEFAULT_DEADLINE_MS")
+    try:
+        return time.monotonic() + float(budget) / 1000 if budget else None
+    except ValueError:
+        return None
+
+def request_priority():
+    return PRIORITIES.get(request.headers.get('X-Priority', '').lower(), INTERACTIVE)
+
+def form_flag(name):
+    return request.form.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+def overloaded_response(e):
+    resp = jsonify(error=str(e))
+    resp.headers['Retry-After'] = str(int(e.retry_after))
+    return resp, 503
+
+def detect(image_bytes, crop, priority=INTERACTIVE, deadline=None, regions=False):
+    """Run the crop's detector behind admission control. Returns the prediction fields of a response.
+
+    With `regions`, each leaf in the photo is located and classified separately
+    and the fields gain a "leaves" list with bounding boxes.
+    """
+    buf = io.BytesIO(image_bytes)
+    leaves = None
+    if crop == 'banana':
+        with admission['banana'].slot(priority, deadline):
+            if regions:
+                disease_name, confidence, _, leaves = predict_leaves_banana(buf, crop)
+            else:
+                disease_name, confidence, _ = predict_disease_banana(buf, crop)
+    else:
+        with admission['tomato'].slot(priority, deadline):
+            if regions:
+                disease_name, confidence, _, leaves = predict_leaves_tomato(buf, crop)
+            else:
+                disease_name, confidence, _ = predict_disease_tomato(buf, crop)
+
+    fields = {
+        "crop_type":  crop,
+        "disease":    disease_name,
+        "confidence": f"{confidence*100:.2f}%",
+    }
+    if leaves is not None:
+        fields["leaves"] = [
+            {"bbox": l["bbox"], "disease": l["disease"], "confidence": f"{l['confidence']*100:.2f}%"}
+            for l in leaves
+        ]
+    return fields
+
+def run_prediction(image_bytes, crop, location, priority=INTERACTIVE, deadline=None, regions=False):
+    """Disease detection, weather and disease recommendations for one image."""
+    prediction = detect(image_bytes, crop, priority, deadline, regions)
+    disease_name = prediction["disease"]
+    weather  = get_weather(location)
+
+    # get raw list of recomms
+    rec_list = get_disease_recommendations(disease_name, crop)
+    inner = {
+        "disease_name": disease_name,
+        "crop_type":    crop,
+        "recommendations": rec_list
+    }
+    api_resp = {
+        "result":      json.dumps(inner),
+        "status":      True,
+        "server_code": 200
+    }
+
+    return {
+        **prediction,
+        "weather":                 weather,
+        "disease_recomendations":  json.dumps(api_resp)
+    }
+
+JOB_ADMISSION_WAIT_S = 120  # well inside the job lease, so a waiting job is never picked up twice
+
+def run_prediction_job(payload, image_bytes):
+    """Job worker entry point: bulk priority, and wait out saturation instead of failing the job."""
+    give_up = time.monotonic() + JOB_ADMISSION_WAIT_S
+    while True:
+        try:
+            # the deadline also bounds the wait inside the admission queue, not just these retries
+            return run_prediction(image_bytes, payload["crop"], payload["location"], priority=BULK,
+                                  deadline=give_up, regions=payload.get("regions", False))
+        except Overloaded as e:
+            if time.monotonic() + e.retry_after > give_up:
+                raise
+            time.sleep(e.retry_after)
+
+# background prediction jobs (see jobs.py); results are kept for JOB_TTL_SECONDS
+BASE_DIR = os.path.dirname(__file__)
+jobs = JobQueue(
+    os.getenv("JOBS_DB", os.path.abspath(os.path.join(BASE_DIR, "..", "data", "jobs.sqlite3"))),
+    handler=run_prediction_job,
+    workers=int(os.getenv("JOB_WORKERS", "2")),
+    ttl=float(os.getenv("JOB_TTL_SECONDS", "3600")),
+)
+
+# Workers run only in the process that serves requests. Imported by a WSGI server
+# (e.g. gunicorn app:app) that is this process; when run as a script see __main__ below.
+if __name__ != '__main__':
+    jobs.start()
+
 # image detection and recomendations
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -28,41 +151,123 @@ def predict():
         if img.filename=='' or not allowed_file(img.filename):
             return jsonify(error="Invalid image"),400
 
-        buf  = io.BytesIO(img.read())
         crop = request.form.get('crop', "")[:50]
-
-        if crop == 'banana':
-            disease_name, confidence, _ = predict_disease_banana(buf, crop)
-        else:
-            disease_name, confidence, _ = predict_disease_tomato(buf, crop)
         location = request.form.get('location','Colombo')
-        weather  = get_weather(location)
-
-        # get raw list of recomms
-        rec_list = get_disease_recommendations(disease_name, crop)
-        inner = {
-            "disease_name": disease_name,
-            "crop_type":    crop,
-            "recommendations": rec_list
-        }
-        api_resp = {
-            "result":      json.dumps(inner),
-            "status":      True,
-            "server_code": 200
-        }
+        return jsonify(run_prediction(img.read(), crop, location, request_priority(), request_deadline(),
+                                      regions=form_flag('regions')))
 
-        return jsonify({
-            "crop_type":               crop,
-            "disease":                 disease_name,
-            "confidence":              f"{confidence*100:.2f}%",
-            "weather":                 weather,
-            "disease_recomendations":  json.dumps(api_resp)
-        })
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(error=str(e)),500
 
+# streamed variant of /predict (Server-Sent Events): "prediction", "weather", then one
+# "recommendation" event per item as the LLM writes it, and finally "done" (or "error")
+stream_slots = threading.BoundedSemaphore(int(os.getenv("MAX_STREAMS", "8")))
+weather_pool = ThreadPoolExecutor(max_workers=int(os.getenv("MAX_STREAMS", "8")), thread_name_prefix="weather")
+STREAM_BUFFER        = int(os.getenv("STREAM_BUFFER", "8"))
+STREAM_STALL_SECONDS = float(os.getenv("STREAM_STALL_SECONDS", "30"))
+
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    if 'image' not in request.files:
+        return jsonify(error="No image provided"),400
+    img = request.files['image']
+    if img.filename=='' or not allowed_file(img.filename):
+        return jsonify(error="Invalid image"),400
+
+    # every open stream holds a server thread, so their number is capped
+    if not stream_slots.acquire(blocking=False):
+        resp = jsonify(error="Too many open streams")
+        resp.headers['Retry-After'] = "5"
+        return resp, 503
+    released = threading.Lock()
+    def release():
+        if released.acquire(blocking=False):
+            stream_slots.release()
+
+    crop = request.form.get('crop', "")[:50]
+    location = request.form.get('location','Colombo')
+    try:
+        # weather doesn't depend on the prediction, so fetch it while the model runs
+        weather = weather_pool.submit(get_weather, location)
+        prediction = detect(img.read(), crop, request_priority(), request_deadline(), form_flag('regions'))
+    except Overloaded as e:
+        release()
+        return overloaded_response(e)
     except Exception as e:
+        release()
         traceback.print_exc()
         return jsonify(error=str(e)),500
 
+    def produce(emit, cancelled):
+        emit("prediction", prediction)
+        try:
+            emit("weather", weather.result(timeout=30))
+        except Exception as e:
+            emit("weather", {"error": f"Failed to fetch weather data: {e}"})
+        count = 0
+        for item in stream_disease_recommendations(prediction["disease"], crop, cancelled):
+            emit("recommendation", {"index": count, "text": item})
+            count += 1
+        emit("done", {"count": count})
+
+    # the stall timeout stops the producer; this bounds the server thread's write to a stalled
+    # client so it (and its stream slot) is freed too. Other WSGI servers need their own write timeout.
+    sock = request.environ.get('werkzeug.socket')
+    if sock is not None:
+        sock.settimeout(STREAM_STALL_SECONDS)
+
+    resp = Response(bounded_events(produce, STREAM_BUFFER, STREAM_STALL_SECONDS), mimetype="text/event-stream")
+    resp.headers['Cache-Control'] = "no-cache"
+    resp.headers['X-Accel-Buffering'] = "no"
+    resp.call_on_close(release)
+    return resp
+
+# same as /predict, but returns a job id right away; poll /jobs/<id> or pass callback_url
+@app.route('/jobs/predict', methods=['POST'])
+def submit_prediction_job():
+    try:
+        if 'image' not in request.files:
+            return jsonify(error="No image provided"),400
+        img = request.files['image']
+        if img.filename=='' or not allowed_file(img.filename):
+            return jsonify(error="Invalid image"),400
+
+        callback_url = request.form.get('callback_url') or None
+        if callback_url and not callback_url.startswith(('http://', 'https://')):
+            return jsonify(error="callback_url must be an http(s) URL"),400
+        idempotency_key = (request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or "")[:200] or None
+
+        payload = {
+            "crop":     request.form.get('crop', "")[:50],
+            "location": request.form.get('location','Colombo'),
+            "regions":  form_flag('regions'),
+        }
+        job, created = jobs.submit(payload, img.read(), idempotency_key, callback_url)
+        job["status_url"] = f"/jobs/{job['id']}"
+        return jsonify(job), (202 if created else 200)
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify(error=str(e)),500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_prediction_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found or expired"),404
+    return jsonify(job)
+
+# admission control and job queue metrics
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "admission": {name: ctl.metrics() for name, ctl in admission.items()},
+        "jobs":      jobs.stats(),
+    })
+
 # focast weather related recomendations
 @app.route('/recommendations', methods=['POST'])
 def get_crop_recommendations():
@@ -86,4 +291,8 @@ def get_crop_recommendations():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # debug=True runs the reloader: a watcher parent that never serves and a serving
+    # child, marked by WERKZEUG_RUN_MAIN; only the child should claim jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.start()
     app.run(debug=True)
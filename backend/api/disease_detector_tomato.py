@@ -2,16 +2,20 @@ import os
 import json
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-from tensorflow.keras.applications.efficientnet import preprocess_input
-import cv2
+
+import model_registry
+from inference import preprocess_image, model_input, resolve_prediction, predict_regions, aggregate_regions, ROI_MAX_REGIONS
 
 # ─── PATHS & SETTINGS ────────────────────────────────────────────────────────
 BASE_DIR    = os.path.dirname(__file__)
 MODEL_DIR   = os.path.abspath(os.path.join(BASE_DIR, "..", "models"))
-MODEL_FP    = os.path.join(MODEL_DIR, "tomato_ensemble_disease_classifier.h5")
-IDX_FP      = os.path.join(MODEL_DIR, "class_indices_tomato.json")
-IMG_SIZE    = (224, 224)
+# Versioned artifacts from train.py (models/tomato/LATEST) win over the legacy flat files
+MODEL_FP, IDX_FP = model_registry.resolve(
+    "tomato",
+    os.path.join(MODEL_DIR, "tomato_ensemble_disease_classifier.h5"),
+    os.path.join(MODEL_DIR, "class_indices_tomato.json"),
+)
+HEALTHY     = "Tomato___healthy"
 
 # ─── LOAD MODEL & CLASS MAP ──────────────────────────────────────────────────
 print(f"Loading ensemble model from {MODEL_FP}")
@@ -23,43 +27,17 @@ idx2cls = {v: k for k, v in cls2idx.items()}
 
 # ─── UTILITIES ───────────────────────────────────────────────────────────────
 def humanize(label: str) -> str:
-    if label == "Tomato___healthy":
+    if label == HEALTHY:
         return "No disease, the Tomato is healthy"
     return label.replace("_", " ")
 
-def preprocess_image(path: str):
-    """Load, resize, and apply CLAHE to image."""
-    # Resizes it to 224×224 pixels (EfficientNet/MobileNet input size).Converts it to a NumPy array.
-    img = load_img(path, target_size=IMG_SIZE)
-    arr = img_to_array(img).astype("uint8")
-
-   # Convert RGB to LAB Color Space
-    lab = cv2.cvtColor(arr, cv2.COLOR_RGB2LAB)
-    l, a, b = cv2.split(lab)
-
-    # Apply CLAHE to Lightness Channel
-    # CLAHE = Contrast Limited Adaptive Histogram Equalization. It enhances local contrast and reveals subtle leaf texture/patterns
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
-
-    # Mergerd andConvert back to RGB so the CNN model can understand it.
-    merged = cv2.merge((cl, a, b))
-    enhanced = cv2.cvtColor(merged, cv2.COLOR_LAB2RGB)
-
-    return arr, enhanced
-
-
-
+# ─── Function of Tomato prediction ───────────────────────────────────────────────────
 def predict_disease_tomato(image_path: str, crop: str = "Tomato"):
     """Return (human_readable_label, confidence, crop)."""
     original, enhanced = preprocess_image(image_path)
 
-   # Preprocess the enhanced image using preprocess_input (EfficientNet-style normalization).
-   #Expand dimensions to shape [1, 224, 224, 3].Feed the same input twice because this model expects a [EffNet_input, MobNet_input] pair.
-    inp = preprocess_input(enhanced.astype("float32"))
-    inp = np.expand_dims(inp, axis=0)
-
-    # Ensemble input expects [EffNet_input, MobNet_input]
+    # Ensemble input expects [EffNet_input, MobNet_input]; feed the same image to both
+    inp = np.expand_dims(model_input(enhanced), axis=0)
     probs = model.predict([inp, inp])[0]
 
     # Debug: Show top-3 predictions
@@ -68,42 +46,29 @@ def predict_disease_tomato(image_path: str, crop: str = "Tomato"):
     for i in top3:
         print(f"- {idx2cls[i]}: {probs[i]:.2%}")
 
-    idx = int(np.argmax(probs))
-    label = idx2cls[idx]
-    name = humanize(label)
-    conf = float(probs[idx])
-
     # Fallback logic: double-check if wrongly low-confidence disease
-    if label != "Tomato___healthy" and conf < 0.65:
-        hsv = cv2.cvtColor(original, cv2.COLOR_RGB2HSV)
-        mask = cv2.inRange(hsv, (35, 50, 50), (85, 255, 255))
-        green_ratio = np.sum(mask) / (mask.size * 255)
-        # Measures how much of the leaf is green.If green > 60%, it might actually be healthy.
+    idx, overridden = resolve_prediction(probs, original, cls2idx, idx2cls, HEALTHY)
+    if overridden:
+        print("🔁 Overridden as Healthy due to visual cues")
 
-        gray = cv2.cvtColor(original, cv2.COLOR_RGB2GRAY)
-        blur = cv2.GaussianBlur(gray, (5, 5), 0)
-        sx = cv2.Sobel(blur, cv2.CV_64F, 1, 0, ksize=3)
-        sy = cv2.Sobel(blur, cv2.CV_64F, 0, 1, ksize=3)
-        edge_intensity = np.mean(np.sqrt(sx**2 + sy**2))
-        # Uses Sobel filter to measure edge sharpness and texture. If edges are smooth (low intensity), it's more likely a healthy leaf.
+    name = humanize(idx2cls[idx])
+    conf = float(probs[idx])
+    print(f"→ Final prediction: {name} @ {conf:.2%}")
+    return name, conf, crop
 
-        print(f"Image analysis — Green ratio: {green_ratio:.3f}, Edge intensity: {edge_intensity:.3f}")
+# ─── Per-leaf prediction for large photos ────────────────────────────────────────────
+def predict_leaves_tomato(image_path: str, crop: str = "Tomato", max_regions: int = ROI_MAX_REGIONS):
+    """Classify each detected leaf in one batch. Returns (label, confidence, crop, leaves)."""
+    leaves = predict_regions(model, image_path, cls2idx, idx2cls, HEALTHY, max_regions)
+    idx, conf = aggregate_regions(leaves, cls2idx.get(HEALTHY, -1))
 
-        healthy_idx = cls2idx.get("Tomato___healthy", -1)
-        if (
-            green_ratio > 0.60 and
-            edge_intensity < 18 and
-            healthy_idx in top3 and
-            probs[healthy_idx] > 0.25
-        ):
-            idx = healthy_idx
-            label = "Tomato___healthy"
-            name = humanize(label)
-            conf = float(probs[healthy_idx])
-            print("🔁 Overridden as Healthy due to visual cues")
+    for leaf in leaves:
+        leaf["disease"] = humanize(idx2cls[leaf.pop("idx")])
+        print(f"- leaf {leaf['bbox']}: {leaf['disease']} @ {leaf['confidence']:.2%}")
 
-    print(f"→ Final prediction: {name} @ {conf:.2%}")
-    return name, conf, crop
+    name = humanize(idx2cls[idx])
+    print(f"→ Final prediction: {name} @ {conf:.2%} from {len(leaves)} leaves")
+    return name, conf, crop, leaves
 
 # ─── CLI SUPPORT ─────────────────────────────────────────────────────────────
 if __name__ == "__main__":
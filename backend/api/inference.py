@@ -0,0 +1,254 @@
+import io
+import os
+import time
+import threading
+from collections import deque
+
+import numpy as np
+from tensorflow.keras.preprocessing.image import load_img, img_to_array
+from tensorflow.keras.applications.efficientnet import preprocess_input
+from PIL import Image, ImageOps
+import cv2
+
+# Shared serving-time preprocessing and healthy-leaf fallback used by both
+# detectors and by evaluate.py, so offline numbers match what the API returns.
+
+IMG_SIZE = (224, 224)
+
+# Fallback thresholds: a low-confidence disease prediction on a very green,
+# smooth image is overridden as healthy if "healthy" is still in the top 3.
+FALLBACK_MAX_CONF   = 0.65
+FALLBACK_MIN_GREEN  = 0.60
+FALLBACK_MAX_EDGE   = 18
+FALLBACK_MIN_HEALTHY_PROB = 0.25
+
+# Leaf region-of-interest detection for large photos: regions are found on a
+# small copy, cropped from the full-resolution image and classified as one batch.
+ROI_DECODE_SIDE   = 1600   # JPEGs are decoded at reduced scale down to about this longest side
+ROI_ANALYSIS_SIDE = 512    # longest side of the copy used to find leaves
+ROI_MAX_REGIONS   = 4
+ROI_MIN_AREA      = 0.02   # smallest region kept, as a fraction of the image area
+ROI_PAD           = 0.08   # context added around each region, as a fraction of its size
+ROI_BUDGET_MS     = float(os.getenv("ROI_BUDGET_MS", "250"))  # decode + detect + crop + batched inference
+ROI_CALL_COST_MS   = 40    # starting estimates of a batch's fixed cost and its cost per region,
+ROI_REGION_COST_MS = 20    # refitted from measured batches as requests run
+
+
+class _BatchCost:
+    """Time of one batch of n regions, modelled as fixed_ms + n * region_ms and fitted to recent batches."""
+
+    def __init__(self, window: int = 32):
+        self.fixed_ms = ROI_CALL_COST_MS
+        self.region_ms = ROI_REGION_COST_MS
+        self._samples = deque(maxlen=window)
+        self._warm = False
+        self._lock = threading.Lock()
+
+    def regions_within(self, ms: float) -> int:
+        with self._lock:
+            return int((ms - self.fixed_ms) // self.region_ms)
+
+    def observe(self, n: int, ms: float):
+        with self._lock:
+            if not self._warm:
+                # The first call traces the graph and says nothing about steady-state cost
+                self._warm = True
+                return
+            self._samples.append((n, ms))
+            ns = np.array([s[0] for s in self._samples], dtype="float64")
+            ts = np.array([s[1] for s in self._samples], dtype="float64")
+            if len(np.unique(ns)) >= 2:
+                region_ms, fixed_ms = np.polyfit(ns, ts, 1)
+                self.region_ms, self.fixed_ms = max(1.0, region_ms), max(0.0, fixed_ms)
+            else:
+                # Only one batch size seen so far: keep the fixed part, the rest is per region
+                self.region_ms = max(1.0, (ts.mean() - self.fixed_ms) / ns[0])
+
+
+_batch_costs = {}          # id(model) -> _BatchCost
+
+
+def preprocess_image(path, img_size=IMG_SIZE):
+    """Load, resize, and apply CLAHE to image. Returns (original, enhanced) uint8 RGB arrays."""
+    img = load_img(path, target_size=img_size)
+    arr = img_to_array(img).astype("uint8")
+    return arr, enhance(arr)
+
+
+def enhance(arr: np.ndarray) -> np.ndarray:
+    """CLAHE on the lightness channel to bring out leaf texture."""
+    lab = cv2.cvtColor(arr, cv2.COLOR_RGB2LAB)
+    l, a, b = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    cl = clahe.apply(l)
+    merged = cv2.merge((cl, a, b))
+    return cv2.cvtColor(merged, cv2.COLOR_LAB2RGB)
+
+
+def model_input(enhanced: np.ndarray) -> np.ndarray:
+    """EfficientNet-style normalization of one enhanced image (no batch dimension)."""
+    return preprocess_input(enhanced.astype("float32"))
+
+
+def green_mask(rgb: np.ndarray) -> np.ndarray:
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+    return cv2.inRange(hsv, (35, 50, 50), (85, 255, 255))
+
+
+def visual_cues(original: np.ndarray):
+    """Return (green_ratio, edge_intensity) for the fallback check."""
+    mask = green_mask(original)
+    green_ratio = np.sum(mask) / (mask.size * 255)
+
+    gray = cv2.cvtColor(original, cv2.COLOR_RGB2GRAY)
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    sx = cv2.Sobel(blur, cv2.CV_64F, 1, 0, ksize=3)
+    sy = cv2.Sobel(blur, cv2.CV_64F, 0, 1, ksize=3)
+    edge_intensity = np.mean(np.sqrt(sx**2 + sy**2))
+    return green_ratio, edge_intensity
+
+
+def resolve_prediction(probs, original, cls2idx: dict, idx2cls: dict, healthy_label: str, verbose: bool = True):
+    """Apply the healthy-leaf fallback to one probability vector.
+
+    Returns (idx, overridden): the served class index, and whether the
+    fallback replaced the argmax.
+    """
+    top3 = np.argsort(probs)[-3:][::-1]
+    idx = int(np.argmax(probs))
+    if idx2cls[idx] == healthy_label or probs[idx] >= FALLBACK_MAX_CONF:
+        return idx, False
+
+    green_ratio, edge_intensity = visual_cues(original)
+    if verbose:
+        print(f"Image analysis — Green ratio: {green_ratio:.3f}, Edge intensity: {edge_intensity:.3f}")
+
+    healthy_idx = cls2idx.get(healthy_label, -1)
+    if (
+        green_ratio > FALLBACK_MIN_GREEN and
+        edge_intensity < FALLBACK_MAX_EDGE and
+        healthy_idx in top3 and
+        probs[healthy_idx] > FALLBACK_MIN_HEALTHY_PROB
+    ):
+        return healthy_idx, True
+    return idx, False
+
+
+# ─── LEAF REGIONS ────────────────────────────────────────────────────────────
+def decode_for_regions(image, max_side: int = ROI_DECODE_SIDE):
+    """Decode a path or BytesIO into an RGB uint8 array with EXIF orientation applied.
+
+    Large JPEGs are decoded by libjpeg at 1/2, 1/4 or 1/8 scale, never below
+    `max_side` on the longest side, which is far cheaper than a full 12 MP
+    decode and still leaves each leaf crop well above the model input size.
+    Returns (rgb, factor) where factor maps decoded pixels back to the photo's.
+    """
+    if hasattr(image, "getvalue"):
+        raw = image.getvalue()
+    else:
+        with open(image, "rb") as f:
+            raw = f.read()
+    img = Image.open(io.BytesIO(raw))
+    w, h = img.size
+    scale = min(1.0, max_side / max(w, h))
+    img.draft("RGB", (int(w * scale), int(h * scale)))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    return np.asarray(img), max(w, h) / max(img.size)
+
+
+def find_leaf_regions(rgb: np.ndarray, max_regions: int = ROI_MAX_REGIONS,
+                      min_area: float = ROI_MIN_AREA, pad: float = ROI_PAD):
+    """Return up to `max_regions` leaf boxes (x, y, w, h) in `rgb` pixel coordinates, largest first.
+
+    Works on a downscaled copy: the green mask is closed so lesions inside a
+    leaf don't split it, and the outer contours become the regions.
+    """
+    h, w = rgb.shape[:2]
+    scale = min(1.0, ROI_ANALYSIS_SIDE / max(h, w))
+    small = cv2.resize(rgb, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    mask = green_mask(small)
+    k = max(3, int(min(small.shape[:2]) * 0.03) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_px = min_area * small.shape[0] * small.shape[1]
+    contours = sorted((c for c in contours if cv2.contourArea(c) >= min_px), key=cv2.contourArea, reverse=True)
+
+    boxes = []
+    for c in contours[:max_regions]:
+        x, y, bw, bh = cv2.boundingRect(c)
+        px, py = int(bw * pad), int(bh * pad)
+        x0, y0 = max(0, x - px), max(0, y - py)
+        x1, y1 = min(small.shape[1], x + bw + px), min(small.shape[0], y + bh + py)
+        boxes.append((int(x0 / scale), int(y0 / scale), int((x1 - x0) / scale), int((y1 - y0) / scale)))
+    return boxes
+
+
+def crop_region(rgb: np.ndarray, box, img_size=IMG_SIZE):
+    """Cut one box out of the decoded image. Returns (original, model_input) like preprocess_image."""
+    x, y, w, h = box
+    crop = cv2.resize(rgb[y:y + h, x:x + w], img_size, interpolation=cv2.INTER_AREA)
+    return crop, model_input(enhance(crop))
+
+
+def predict_regions(model, image, cls2idx: dict, idx2cls: dict, healthy_label: str,
+                    max_regions: int = ROI_MAX_REGIONS, budget_ms: float = ROI_BUDGET_MS):
+    """Find leaves, classify all crops in one forward pass, and apply the fallback per leaf.
+
+    Returns a list of {"bbox", "idx", "confidence", "overridden"} dicts, with
+    bbox as [x, y, w, h] in the original photo's pixels. When no
+    leaf is found the whole frame is used as the only region, preprocessed
+    exactly as for a plain prediction.
+
+    `budget_ms` covers the whole stage. The number of regions classified is
+    what the time left after decoding and detection allows, going by the
+    measured cost of a batch; if not even one fits, only the whole frame is
+    classified.
+    """
+    start = time.perf_counter()
+    rgb, factor = decode_for_regions(image)
+    h, w = rgb.shape[:2]
+    boxes = []
+    if (time.perf_counter() - start) * 1000 < budget_ms:
+        boxes = find_leaf_regions(rgb, max_regions)
+
+    cost = _batch_costs.setdefault(id(model), _BatchCost())
+    n = cost.regions_within(budget_ms - (time.perf_counter() - start) * 1000)
+    if boxes and n < 1:
+        print(f"Leaf region budget of {budget_ms:.0f} ms spent before inference, classifying the whole frame")
+        boxes = []
+    elif 0 < n < len(boxes):
+        print(f"Leaf region budget of {budget_ms:.0f} ms allows {n}/{len(boxes)} regions")
+        boxes = boxes[:n]
+
+    if boxes:
+        infer_start = time.perf_counter()
+        originals, inputs = zip(*(crop_region(rgb, box) for box in boxes))
+    else:
+        # Whole frame: same decode and resize as predict_disease_*, so it answers the same
+        if hasattr(image, "seek"):
+            image.seek(0)
+        original, enhanced = preprocess_image(image)
+        originals, inputs = [original], [model_input(enhanced)]
+        boxes = [(0, 0, w, h)]
+        infer_start = time.perf_counter()   # the full decode above isn't part of a batch's cost
+    batch = np.stack(inputs)
+    probs = model.predict([batch, batch])
+    cost.observe(len(boxes), (time.perf_counter() - infer_start) * 1000)
+
+    leaves = []
+    for box, p, original in zip(boxes, probs, originals):
+        idx, overridden = resolve_prediction(p, original, cls2idx, idx2cls, healthy_label, verbose=False)
+        bbox = [int(round(v * factor)) for v in box]
+        leaves.append({"bbox": bbox, "idx": idx, "confidence": float(p[idx]), "overridden": overridden})
+    return leaves
+
+
+def aggregate_regions(leaves: list, healthy_idx: int):
+    """Overall (idx, confidence) for a photo: its most confident disease, or healthy if every leaf is."""
+    diseased = [l for l in leaves if l["idx"] != healthy_idx]
+    pick = max(diseased or leaves, key=lambda l: l["confidence"])
+    return pick["idx"], pick["confidence"]
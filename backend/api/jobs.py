@@ -0,0 +1,309 @@
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import traceback
+
+import requests
+
+# Durable background job queue backed by a local SQLite file (no broker).
+#
+# A job row moves queued → running → done | failed. Workers claim a row by
+# taking a time-limited lease, renewed while the job runs, so a job whose
+# worker died (crash, restart) is picked up again once the lease runs out.
+# The claim's attempt number is the lease's owner: a worker that lost its
+# lease can no longer record an outcome. Finished rows are kept until
+# `expires` and then purged; the uploaded image is dropped as soon as the job
+# finishes. Callbacks are sent by their own threads, so a slow or unreachable
+# callback URL never holds up inference workers.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id               TEXT PRIMARY KEY,
+    idempotency_key  TEXT UNIQUE,
+    status           TEXT NOT NULL,
+    payload          TEXT NOT NULL,
+    image            BLOB,
+    result           TEXT,
+    error            TEXT,
+    callback_url     TEXT,
+    callback_status  TEXT,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    lease_until      REAL,
+    created          REAL NOT NULL,
+    updated          REAL NOT NULL,
+    expires          REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires);
+"""
+
+PUBLIC_FIELDS = ("id", "status", "result", "error", "callback_status", "attempts", "created", "updated", "expires")
+
+
+class JobQueue:
+    def __init__(self, db_path: str, handler, workers: int = 2, ttl: float = 3600,
+                 lease: float = 300, max_attempts: int = 3, poll_interval: float = 1.0,
+                 callback_retries: int = 3, callback_timeout: float = 10, callback_workers: int = 4):
+        """`handler(payload: dict, image: bytes) -> dict` does the work for one job."""
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.callback_retries = callback_retries
+        self.callback_timeout = callback_timeout
+        self.callback_workers = callback_workers
+        self._callbacks = queue.Queue()
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    # ─── Public API ──────────────────────────────────────────────────────────
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        # Callbacks still owed from before a restart
+        db = self._connect()
+        try:
+            rows = db.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND callback_url IS NOT NULL "
+                "AND callback_status IS NULL"
+            ).fetchall()
+        finally:
+            db.close()
+        for r in rows:
+            self._callbacks.put(r["id"])
+
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        for i in range(self.callback_workers):
+            threading.Thread(target=self._send_callbacks, name=f"job-callback-{i}", daemon=True).start()
+        threading.Thread(target=self._purge_loop, name="job-janitor", daemon=True).start()
+
+    def submit(self, payload: dict, image: bytes, idempotency_key: str = None, callback_url: str = None):
+        """Queue a job. Returns (job, created); an unexpired job with the same key is returned as-is."""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if idempotency_key:
+                row = db.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                if row and (row["expires"] is None or row["expires"] > now):
+                    db.execute("COMMIT")
+                    return self._public(row), False
+                if row:
+                    db.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO jobs (id, idempotency_key, status, payload, image, callback_url, created, updated) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, idempotency_key, json.dumps(payload), sqlite3.Binary(image), callback_url, now, now),
+            )
+            db.execute("COMMIT")
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+        self._wake.set()
+        return self._public(row), True
+
+    def get(self, job_id: str):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None or (row["expires"] is not None and row["expires"] <= time.time()):
+            return None
+        return self._public(row)
+
+    def stats(self) -> dict:
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        finally:
+            db.close()
+        return {r["status"]: r["n"] for r in rows}
+
+    @staticmethod
+    def _public(row) -> dict:
+        job = {k: row[k] for k in PUBLIC_FIELDS}
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    # ─── Workers ─────────────────────────────────────────────────────────────
+    def _claim(self):
+        """Atomically take the oldest queued job, or a running one whose lease expired."""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated = ? "
+                "WHERE id = ?",
+                (now + self.lease, now, row["id"]),
+            )
+            db.execute("COMMIT")
+            return row
+        except Exception:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def _finish(self, job_id: str, attempt: int, status: str, result=None, error=None) -> bool:
+        """Record a job's outcome if `attempt` still holds its lease. Returns whether it did."""
+        now = time.time()
+        db = self._connect()
+        try:
+            cur = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, image = NULL, lease_until = NULL, "
+                "updated = ?, expires = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, now, now + self.ttl,
+                 job_id, attempt),
+            )
+            return cur.rowcount == 1
+        finally:
+            db.close()
+
+    def _renew(self, job_id: str, attempt: int, stop: threading.Event):
+        """Keep extending the lease of a running job until `stop` is set."""
+        while not stop.wait(self.lease / 3):
+            try:
+                db = self._connect()
+                try:
+                    db.execute(
+                        "UPDATE jobs SET lease_until = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                        (time.time() + self.lease, job_id, attempt),
+                    )
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error:
+                traceback.print_exc()
+                row = None
+            if row is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+
+            try:
+                self._run(row)
+            except Exception:
+                # e.g. the database stayed locked: the lease runs out and the job is picked up again
+                traceback.print_exc()
+                time.sleep(self.poll_interval)
+
+    def _run(self, row):
+        job_id = row["id"]
+        attempt = row["attempts"] + 1   # the row was read before the claim incremented it
+        # A job that keeps killing its worker (lease expiry) is given up on
+        if attempt > self.max_attempts:
+            finished = self._finish(job_id, attempt, "failed", error=row["error"] or "Too many attempts")
+        else:
+            stop = threading.Event()
+            threading.Thread(target=self._renew, args=(job_id, attempt, stop),
+                             name=f"job-lease-{job_id[:8]}", daemon=True).start()
+            try:
+                result = self.handler(json.loads(row["payload"]), bytes(row["image"]))
+            except Exception as e:
+                traceback.print_exc()
+                finished = self._finish(job_id, attempt, "failed", error=str(e))
+            else:
+                finished = self._finish(job_id, attempt, "done", result=result)
+            finally:
+                stop.set()
+        if not finished:
+            print(f"Job {job_id} attempt {attempt} lost its lease; its outcome was discarded")
+        elif row["callback_url"]:
+            self._callbacks.put(job_id)
+
+    def _send_callbacks(self):
+        while True:
+            job_id = self._callbacks.get()
+            try:
+                self._callback(job_id)
+            except Exception:
+                traceback.print_exc()
+
+    def _callback(self, job_id: str):
+        """POST the finished job to its callback URL, retrying server errors with backoff."""
+        db = self._connect()
+        try:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None or not row["callback_url"]:
+            return
+
+        job = self._public(row)
+        status = "failed"
+        for attempt in range(self.callback_retries):
+            if attempt:
+                time.sleep(2 ** attempt)
+            try:
+                resp = requests.post(row["callback_url"], json=job, timeout=self.callback_timeout)
+                if resp.status_code < 500:
+                    status = f"delivered ({resp.status_code})"
+                    break
+                status = f"failed ({resp.status_code})"
+            except requests.RequestException as e:
+                status = f"failed ({e.__class__.__name__})"
+
+        db = self._connect()
+        try:
+            db.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+        finally:
+            db.close()
+
+    def _purge_loop(self):
+        while True:
+            try:
+                db = self._connect()
+                try:
+                    db.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                traceback.print_exc()
+            time.sleep(min(self.ttl, 60))
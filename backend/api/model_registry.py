@@ -0,0 +1,94 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+# ─── LAYOUT ──────────────────────────────────────────────────────────────────
+# models/<crop>/<version>/model.h5             trained ensemble
+# models/<crop>/<version>/class_indices.json   class → index map used in training
+# models/<crop>/<version>/metadata.json        job config and validation metrics
+# models/<crop>/LATEST                         name of the version the API serves
+# models/<crop>/LATEST.lock                    held while deciding whether to promote
+BASE_DIR  = os.path.dirname(__file__)
+MODEL_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "models"))
+
+MODEL_NAME    = "model.h5"
+INDICES_NAME  = "class_indices.json"
+METADATA_NAME = "metadata.json"
+LATEST_NAME   = "LATEST"
+
+
+def version_dir(crop: str, version: str) -> str:
+    return os.path.join(MODEL_DIR, crop, version)
+
+
+def new_version(tag: str = "") -> str:
+    version = time.strftime("%Y%m%d-%H%M%S")
+    return f"{version}-{tag}" if tag else version
+
+
+def latest_version(crop: str):
+    """Return the promoted version for a crop, or None if nothing was promoted yet."""
+    fp = os.path.join(MODEL_DIR, crop, LATEST_NAME)
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as f:
+        return f.read().strip() or None
+
+
+def read_metadata(crop: str, version: str) -> dict:
+    fp = os.path.join(version_dir(crop, version), METADATA_NAME)
+    if not os.path.exists(fp):
+        return {}
+    with open(fp) as f:
+        return json.load(f)
+
+
+@contextmanager
+def promotion_lock(crop: str):
+    """Hold the crop's promotion lock, so reading LATEST and promoting is one step across processes."""
+    os.makedirs(os.path.join(MODEL_DIR, crop), exist_ok=True)
+    with open(os.path.join(MODEL_DIR, crop, LATEST_NAME + ".lock"), "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def promote(crop: str, version: str):
+    """Point LATEST at `version`. The swap is atomic so a loading API never sees a partial file."""
+    fp = os.path.join(MODEL_DIR, crop, LATEST_NAME)
+    tmp = fp + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp, fp)
+    print(f"Promoted {crop} model version {version}")
+
+
+def resolve(crop: str, legacy_model_fp: str, legacy_idx_fp: str):
+    """Return (model_path, class_indices_path) the detector for `crop` should load.
+
+    MODEL_VERSION_<CROP> in the environment pins a version; otherwise the
+    promoted LATEST version is used, and the legacy flat files are the
+    fallback when no versioned artifacts exist.
+    """
+    version = os.getenv(f"MODEL_VERSION_{crop.upper()}") or latest_version(crop)
+    if version:
+        d = version_dir(crop, version)
+        return os.path.join(d, MODEL_NAME), os.path.join(d, INDICES_NAME)
+    return legacy_model_fp, legacy_idx_fp
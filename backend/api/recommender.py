@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import requests
 from dotenv import load_dotenv
 
@@ -8,6 +9,8 @@ load_dotenv()
 RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY")
 RAPIDAPI_HOST = os.getenv("RAPIDAPI_HOST", "chatgpt-42.p.rapidapi.com")
 RAPIDAPI_URL  = os.getenv("RAPIDAPI_URL", "https://chatgpt-42.p.rapidapi.com/conversationllama3")
+# "rapidapi" (default) or "stub", a local canned provider for tests and offline development
+LLM_PROVIDER  = os.getenv("LLM_PROVIDER", "rapidapi")
 
 COMMON_HEADERS = {
     "x-rapidapi-key": RAPIDAPI_KEY or "",
@@ -17,6 +20,8 @@ COMMON_HEADERS = {
 
 def _post_chat(payload: dict) -> dict:
     """Low-level helper to call the RapidAPI endpoint and return JSON or raise."""
+    if LLM_PROVIDER == "stub":
+        return {"result": _stub_answer(payload)}
     if not RAPIDAPI_KEY:
         raise RuntimeError("RAPIDAPI_KEY is missing. Check your .env")
     try:
@@ -85,7 +90,7 @@ def generate_recommendations(weather_data, crop_type, lang="en"):
         # If the model didn’t comply, return safe defaults
         return {"risks": [], "recommendations": []}
 
-def get_disease_recommendations(disease_name, crop_type):
+def _disease_payload(disease_name, crop_type):
     system_content = (
         "You are ChatGPT, an expert agronomist that provides disease-specific recommendations and tips "
         "based on the disease name and crop type. Return ONLY valid JSON as instructed."
@@ -101,7 +106,7 @@ def get_disease_recommendations(disease_name, crop_type):
         "No text outside the JSON object."
     )
 
-    payload = {
+    return {
         "messages": [
             {"role": "system", "content": system_content},
             {"role": "user", "content": user_content},
@@ -109,7 +114,8 @@ def get_disease_recommendations(disease_name, crop_type):
         "web_access": False
     }
 
-    data = _post_chat(payload)
+def get_disease_recommendations(disease_name, crop_type):
+    data = _post_chat(_disease_payload(disease_name, crop_type))
 
     text = (data.get("result")
             or data.get("content")
@@ -134,3 +140,183 @@ def get_disease_recommendations(disease_name, crop_type):
         }
     except Exception:
         return {"disease_name": disease_name, "crop_type": crop_type, "recommendations": []}
+
+
+# ─── STREAMING ───────────────────────────────────────────────────────────────
+def _chunk_text(chunk) -> str:
+    """Text carried by one streamed event, for the common chat-completion shapes."""
+    if not isinstance(chunk, dict):
+        return ""
+    choice = (chunk.get("choices") or [{}])[0]
+    return ((choice.get("delta") or {}).get("content")
+            or (choice.get("message") or {}).get("content")
+            or chunk.get("content")
+            or chunk.get("result")
+            or "")
+
+def _stream_chat_rapidapi(payload: dict, cancelled=None):
+    """Yield text chunks from the provider's streaming mode.
+
+    Handles Server-Sent Events ("data: {...}" lines) as well as providers that
+    ignore "stream" and answer with a single JSON body.
+    """
+    if not RAPIDAPI_KEY:
+        raise RuntimeError("RAPIDAPI_KEY is missing. Check your .env")
+    try:
+        resp = requests.post(RAPIDAPI_URL, headers=COMMON_HEADERS, data=json.dumps({**payload, "stream": True}),
+                             timeout=60, stream=True)
+    except requests.RequestException as e:
+        raise RuntimeError(f"Network error calling RapidAPI: {e}") from e
+
+    with resp:
+        if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+            try:
+                data = resp.json()
+            except ValueError:
+                raise RuntimeError(f"Non-JSON response (status {resp.status_code}): {resp.text[:500]}")
+            if isinstance(data, dict) and "recommendations" in data:
+                yield json.dumps(data)
+            else:
+                yield _chunk_text(data) or (data.get("message", "") if isinstance(data, dict) else "")
+            return
+
+        # SSE is UTF-8 by spec; without a charset requests would decode it as ISO-8859-1
+        resp.encoding = "utf-8"
+        for line in resp.iter_lines(decode_unicode=True):
+            if cancelled is not None and cancelled.is_set():
+                return
+            if not line or not line.startswith("data:"):
+                continue
+            body = line[len("data:"):].strip()
+            if body == "[DONE]":
+                return
+            try:
+                yield _chunk_text(json.loads(body))
+            except ValueError:
+                yield body
+
+def _stub_answer(payload: dict) -> str:
+    """Canned JSON answer of the shape the prompt asks for (weather risks or disease recommendations)."""
+    user = payload["messages"][-1]["content"]
+    if '"risks"' in user:
+        return json.dumps({
+            "risks": ["Stub risk: prolonged leaf wetness."],
+            "recommendations": [f"Stub answer for a {len(user)}-character prompt."],
+        })
+    return json.dumps({
+        "disease_name": "stub",
+        "crop_type": "stub",
+        "recommendations": [
+            "Remove and destroy affected leaves.",
+            "Avoid overhead irrigation; water at the base in the morning.",
+            "Apply a registered fungicide following the label.",
+            f"Stub answer for a {len(user)}-character prompt.",
+        ],
+    })
+
+def _stream_chat_stub(payload: dict, cancelled=None):
+    """Local stand-in for the provider: streams the canned answer in small pieces."""
+    answer = _stub_answer(payload)
+    delay = float(os.getenv("LLM_STUB_DELAY", "0.02"))
+    for i in range(0, len(answer), 16):
+        if cancelled is not None and cancelled.is_set():
+            return
+        time.sleep(delay)
+        yield answer[i:i + 16]
+
+def stream_chat(payload: dict, cancelled=None):
+    if LLM_PROVIDER == "stub":
+        return _stream_chat_stub(payload, cancelled)
+    return _stream_chat_rapidapi(payload, cancelled)
+
+
+class JsonArrayStream:
+    """Incrementally pull the items of one array out of a streamed JSON document.
+
+    feed() returns the items of `key`'s array that were completed by the new
+    text. Anything before the key (prose, code fences) is skipped, and an item
+    that doesn't parse is dropped without losing the rest.
+    """
+
+    def __init__(self, key: str):
+        self.marker = f'"{key}"'
+        self.buf = ""
+        self.pos = 0          # scan position in buf
+        self.state = "key"    # key → colon → array → items → done
+        self.depth = 0        # nesting inside the current item
+        self.in_str = False
+        self.escape = False
+        self.item_start = None
+
+    def feed(self, text: str) -> list:
+        self.buf += text
+        items = []
+        while self.pos < len(self.buf) and self.state != "done":
+            if self.state == "key":
+                at = self.buf.find(self.marker, self.pos)
+                if at < 0:
+                    # keep a tail in case the key is split across chunks
+                    self.pos = max(self.pos, len(self.buf) - len(self.marker))
+                    break
+                self.pos = at + len(self.marker)
+                self.state = "array"
+                continue
+
+            ch = self.buf[self.pos]
+            if self.state == "array":
+                if ch == "[":
+                    self.state = "items"
+                elif not (ch.isspace() or ch == ":"):
+                    self.state = "key"   # the key's value isn't an array; look for the next one
+                self.pos += 1
+                continue
+
+            # state == "items"
+            if self.item_start is None:
+                if ch == "]":
+                    self.state = "done"
+                elif not (ch.isspace() or ch == ","):
+                    self.item_start = self.pos
+                    continue
+                self.pos += 1
+                continue
+
+            if self.in_str:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_str = False
+            elif ch == '"':
+                self.in_str = True
+            elif ch in "[{":
+                self.depth += 1
+            elif ch in "]}" and self.depth > 0:
+                self.depth -= 1
+            elif ch in ",]" and self.depth == 0:
+                raw = self.buf[self.item_start:self.pos].strip()
+                self.item_start = None
+                try:
+                    items.append(json.loads(raw))
+                except ValueError:
+                    pass
+                if ch == "]":
+                    self.state = "done"
+            self.pos += 1
+
+        # Drop text that can no longer matter so the buffer doesn't grow with the stream
+        keep = self.item_start if self.item_start is not None else self.pos
+        self.buf, self.pos = self.buf[keep:], self.pos - keep
+        if self.item_start is not None:
+            self.item_start = 0
+        return items
+
+
+def stream_disease_recommendations(disease_name, crop_type, cancelled=None):
+    """Yield disease recommendation strings as soon as each one is complete in the LLM stream."""
+    parser = JsonArrayStream("recommendations")
+    for chunk in stream_chat(_disease_payload(disease_name, crop_type), cancelled):
+        for item in parser.feed(chunk):
+            if isinstance(item, str) and item.strip():
+                yield item
@@ -0,0 +1,90 @@
+import json
+import time
+import queue
+import threading
+import traceback
+
+# Server-Sent Events with bounded backpressure. The producer (model, weather,
+# LLM stream) runs in its own thread and hands events to the response through
+# a small queue. If the client reads too slowly the queue stays full, and after
+# `stall_timeout` the producer gives up, closing the upstream LLM stream, instead
+# of holding it open for a client that isn't keeping up.
+#
+# That only frees the producer: the server thread writing the response can
+# still sit in a socket write to the stalled client. The write itself must be
+# bounded by the server (app.py sets a send timeout on the Werkzeug socket;
+# under another WSGI server use its worker/write timeout).
+
+_DONE = object()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def bounded_events(producer, buffer: int = 8, stall_timeout: float = 30, heartbeat: float = 15):
+    """Run `producer(emit, cancelled)` in a thread and yield its events as SSE text.
+
+    `emit(event, data)` blocks while the buffer is full and stops the producer
+    once the client has stalled for `stall_timeout` seconds or gone away; the
+    response then ends without sending what is still buffered.
+    Producer errors become an "error" event. A comment line is sent every
+    `heartbeat` seconds of silence to keep proxies from closing the connection.
+    """
+    q = queue.Queue(maxsize=buffer)
+    cancelled = threading.Event()
+
+    def emit(event, data):
+        # Wait in short slices so a disconnect is noticed without sitting out the whole stall timeout
+        deadline = time.monotonic() + stall_timeout
+        while not cancelled.is_set():
+            try:
+                q.put((event, data), timeout=min(0.5, max(0.0, deadline - time.monotonic())))
+                return
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    print(f"SSE client stalled for {stall_timeout}s, dropping the stream")
+                    cancelled.set()
+        raise _Cancelled()
+
+    def run():
+        try:
+            producer(emit, cancelled)
+        except _Cancelled:
+            return
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                emit("error", {"error": str(e)})
+            except _Cancelled:
+                return
+        try:
+            q.put(_DONE, timeout=stall_timeout)
+        except queue.Full:
+            cancelled.set()
+
+    worker = threading.Thread(target=run, name="sse-producer", daemon=True)
+    worker.start()
+    last_sent = time.monotonic()
+    try:
+        while not cancelled.is_set():
+            try:
+                item = q.get(timeout=min(0.5, heartbeat))
+            except queue.Empty:
+                if not worker.is_alive() and q.empty():
+                    return
+                if time.monotonic() - last_sent >= heartbeat:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                continue
+            if item is _DONE or cancelled.is_set():
+                return
+            last_sent = time.monotonic()
+            yield sse(*item)
+    finally:
+        # Client disconnected or stream finished: let the producer stop early
+        cancelled.set()
@@ -0,0 +1,133 @@
+import time
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, Overloaded, DeadlineExceeded, INTERACTIVE, BULK
+
+
+def hold(ctl):
+    """Take a slot and return a function that gives it back."""
+    slot = ctl.slot(INTERACTIVE)
+    slot.__enter__()
+    return lambda: slot.__exit__(None, None, None)
+
+
+def in_thread(ctl, priority, deadline=None, work=0.0):
+    """Request a slot from another thread; returns (thread, outcome dict)."""
+    outcome = {}
+
+    def run():
+        try:
+            with ctl.slot(priority, deadline):
+                outcome["ran"] = True
+                time.sleep(work)
+        except DeadlineExceeded as e:
+            outcome["deadline"] = e
+        except Overloaded as e:
+            outcome["overloaded"] = e
+
+    t = threading.Thread(target=run)
+    t.start()
+    return t, outcome
+
+
+def wait_for_queue(ctl, depth, timeout=1.0):
+    end = time.monotonic() + timeout
+    while ctl.metrics()["queue_depth"] != depth:
+        assert time.monotonic() < end, f"queue never reached depth {depth}"
+        time.sleep(0.005)
+
+
+def test_interactive_request_evicts_queued_bulk():
+    ctl = AdmissionController("t", max_in_flight=1, max_queue=1, initial_service_s=0.01)
+    release = hold(ctl)
+    bulk, bulk_outcome = in_thread(ctl, BULK)
+    wait_for_queue(ctl, 1)
+
+    interactive, interactive_outcome = in_thread(ctl, INTERACTIVE)
+    bulk.join(1)
+    assert isinstance(bulk_outcome.get("overloaded"), Overloaded)
+    assert not isinstance(bulk_outcome.get("overloaded"), DeadlineExceeded)
+
+    release()
+    interactive.join(1)
+    assert interactive_outcome == {"ran": True}
+    m = ctl.metrics()
+    assert m["evicted"] == 1 and m["in_flight"] == 0 and m["queue_depth"] == 0
+
+
+def test_full_queue_without_bulk_to_evict_is_overloaded():
+    ctl = AdmissionController("t", max_in_flight=1, max_queue=0)
+    release = hold(ctl)
+    with pytest.raises(Overloaded) as e:
+        with ctl.slot(INTERACTIVE):
+            pass
+    assert e.value.retry_after >= 1
+    release()
+
+
+def test_expired_deadline_is_shed_before_queueing():
+    ctl = AdmissionController("t")
+    with pytest.raises(DeadlineExceeded):
+        with ctl.slot(INTERACTIVE, time.monotonic() - 0.01):
+            pass
+    assert ctl.metrics()["shed_deadline"] == 1
+
+
+def test_unreachable_deadline_is_shed_before_queueing():
+    # The slot is busy and a request holds it for about 10 s, so a 1 s budget can't be met
+    ctl = AdmissionController("t", max_in_flight=1, initial_service_s=10)
+    release = hold(ctl)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        with ctl.slot(INTERACTIVE, start + 1):
+            pass
+    assert time.monotonic() - start < 0.5
+    assert ctl.metrics()["queue_depth"] == 0
+    release()
+
+
+def test_deadline_expires_while_queued():
+    ctl = AdmissionController("t", max_in_flight=1, initial_service_s=0.01)
+    release = hold(ctl)
+    t, outcome = in_thread(ctl, INTERACTIVE, time.monotonic() + 0.1)
+    t.join(1)
+    assert "deadline" in outcome
+    m = ctl.metrics()
+    assert m["queue_depth"] == 0 and m["shed_deadline"] == 1
+
+    release()
+    assert ctl.metrics()["in_flight"] == 0
+
+
+def test_slot_granted_after_deadline_is_handed_on(monkeypatch):
+    ctl = AdmissionController("t", max_in_flight=1, initial_service_s=0.01)
+    release = hold(ctl)
+    patient, patient_outcome = in_thread(ctl, BULK, time.monotonic() + 5)
+    wait_for_queue(ctl, 1)
+
+    class LateWaiter(admission._Waiter):
+        # Wakes on the grant but only gets the lock back once its deadline has passed
+        def __init__(self):
+            super().__init__()
+            wait = self.event.wait
+
+            def late_wait(timeout=None):
+                wait(timeout)
+                time.sleep(0.2)
+            self.event.wait = late_wait
+
+    monkeypatch.setattr(admission, "_Waiter", LateWaiter)
+    late, late_outcome = in_thread(ctl, BULK, time.monotonic() + 0.1)
+    wait_for_queue(ctl, 2)
+    monkeypatch.undo()
+
+    release()   # grants the slot to the earliest deadline, before it expires
+    late.join(1)
+    patient.join(1)
+    assert "deadline" in late_outcome
+    assert patient_outcome == {"ran": True}
+    m = ctl.metrics()
+    assert m["in_flight"] == 0 and m["admitted"] == 2 and m["completed"] == 2
@@ -0,0 +1,70 @@
+import os
+import time
+import tempfile
+
+import pytest
+
+from jobs import JobQueue
+
+
+@pytest.fixture
+def db_path():
+    return os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+
+def wait_for(job_queue, job_id, status, timeout=3.0):
+    end = time.monotonic() + timeout
+    while True:
+        job = job_queue.get(job_id)
+        if job["status"] == status:
+            return job
+        assert time.monotonic() < end, f"job stayed {job['status']}"
+        time.sleep(0.02)
+
+
+def test_resubmission_with_idempotency_key_returns_the_same_job(db_path):
+    q = JobQueue(db_path, handler=lambda payload, image: {})
+    first, created = q.submit({"crop": "tomato"}, b"img", idempotency_key="abc")
+    again, created_again = q.submit({"crop": "tomato"}, b"img", idempotency_key="abc")
+    other, _ = q.submit({"crop": "tomato"}, b"img", idempotency_key="xyz")
+
+    assert created and not created_again
+    assert again["id"] == first["id"]
+    assert other["id"] != first["id"]
+    assert q.stats() == {"queued": 2}
+
+
+def test_expired_lease_is_reclaimed_and_only_its_new_owner_finishes(db_path):
+    q = JobQueue(db_path, handler=lambda payload, image: {}, lease=0.1)
+    job, _ = q.submit({}, b"img")
+
+    first = q._claim()
+    assert first["id"] == job["id"]
+    assert q._claim() is None   # still leased
+
+    time.sleep(0.15)
+    second = q._claim()
+    assert second["id"] == job["id"]
+    assert second["attempts"] == first["attempts"] + 1
+
+    # The worker that lost the lease can't record its outcome; the new owner can
+    assert not q._finish(job["id"], first["attempts"] + 1, "done", result={"from": "first"})
+    assert q._finish(job["id"], second["attempts"] + 1, "done", result={"from": "second"})
+    assert q.get(job["id"])["result"] == {"from": "second"}
+
+
+def test_running_job_keeps_its_lease(db_path):
+    calls = []
+
+    def handler(payload, image):
+        calls.append(time.monotonic())
+        time.sleep(0.5)
+        return {"ok": True}
+
+    q = JobQueue(db_path, handler, workers=2, lease=0.15, poll_interval=0.02)
+    q.start()
+    job, _ = q.submit({}, b"img")
+
+    done = wait_for(q, job["id"], "done")
+    assert done["result"] == {"ok": True}
+    assert len(calls) == 1, "another worker re-ran a job that was still running"
@@ -0,0 +1,131 @@
+import io
+import os
+import sys
+import json
+import time
+import types
+import tempfile
+import threading
+
+import pytest
+
+# Offline LLM and a throwaway job database; both are read when the modules are imported
+os.environ["LLM_PROVIDER"] = "stub"
+os.environ["LLM_STUB_DELAY"] = "0"
+os.environ["JOBS_DB"] = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+from recommender import JsonArrayStream, stream_disease_recommendations  # noqa: E402
+from streaming import bounded_events  # noqa: E402
+
+
+# ─── JsonArrayStream ─────────────────────────────────────────────────────────
+ANSWER = (
+    'Sure, here you go:\n```json\n'
+    '{"disease_name": "Late blight", "recommendations": ['
+    '"Say \\"no\\" to overhead watering, then [prune]", '
+    '{"step": [1, {"n": 2}], "note": "a]b,c}"}, '
+    '{"broken": }, '
+    '"Rotate crops \\\\ every season"'
+    ']}\n```'
+)
+EXPECTED = [
+    'Say "no" to overhead watering, then [prune]',
+    {"step": [1, {"n": 2}], "note": "a]b,c}"},
+    "Rotate crops \\ every season",
+]
+
+
+def test_json_array_stream_whole_document():
+    assert JsonArrayStream("recommendations").feed(ANSWER) == EXPECTED
+
+
+@pytest.mark.parametrize("cut", range(len(ANSWER) + 1))
+def test_json_array_stream_split_at_every_offset(cut):
+    parser = JsonArrayStream("recommendations")
+    assert parser.feed(ANSWER[:cut]) + parser.feed(ANSWER[cut:]) == EXPECTED
+
+
+def test_json_array_stream_one_character_at_a_time():
+    parser = JsonArrayStream("recommendations")
+    items = []
+    for ch in ANSWER:
+        items += parser.feed(ch)
+    assert items == EXPECTED
+
+
+def test_stub_provider_streams_recommendations():
+    items = list(stream_disease_recommendations("Late blight", "tomato"))
+    assert len(items) == 4 and all(isinstance(i, str) for i in items)
+
+
+# ─── /predict/stream ─────────────────────────────────────────────────────────
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture(scope="module")
+def client():
+    # The real detectors load both models on import; the stream only needs their return values
+    fakes = {}
+    for crop in ("banana", "tomato"):
+        mod = types.ModuleType(f"disease_detector_{crop}")
+        setattr(mod, f"predict_disease_{crop}", lambda image, crop_type: ("Late blight", 0.9, crop_type))
+        setattr(mod, f"predict_leaves_{crop}", lambda image, crop_type: ("Late blight", 0.9, crop_type, []))
+        fakes[mod.__name__] = mod
+    saved = {name: sys.modules.get(name) for name in fakes}
+    sys.modules.update(fakes)
+    try:
+        import app
+        app.get_weather = lambda location: {"location": location}
+        yield app.app.test_client()
+    finally:
+        for name, mod in saved.items():
+            if mod is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = mod
+
+
+def test_predict_stream_event_order(client):
+    resp = client.post("/predict/stream", content_type="multipart/form-data",
+                       data={"image": (io.BytesIO(b"jpeg"), "leaf.jpg"), "crop": "tomato"})
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+
+    events = parse_sse(resp.get_data(as_text=True))
+    names = [name for name, _ in events]
+    assert names[:2] == ["prediction", "weather"]
+    assert names[-1] == "done"
+    assert set(names[2:-1]) == {"recommendation"}
+
+    assert events[0][1]["disease"] == "Late blight"
+    recommendations = [data for name, data in events if name == "recommendation"]
+    assert [r["index"] for r in recommendations] == list(range(len(recommendations)))
+    assert events[-1][1] == {"count": len(recommendations)}
+
+
+# ─── Backpressure ────────────────────────────────────────────────────────────
+def test_stalled_client_ends_stream():
+    stopped = threading.Event()
+
+    def producer(emit, cancelled):
+        try:
+            for i in range(100):
+                emit("recommendation", {"index": i})
+            emit("done", {"count": 100})
+        finally:
+            stopped.set()
+
+    stream = bounded_events(producer, buffer=1, stall_timeout=0.2, heartbeat=0.1)
+    assert next(stream).startswith("event: recommendation")
+
+    time.sleep(0.5)   # the client stops reading for longer than the stall timeout
+    assert stopped.wait(1), "producer kept running for a stalled client"
+
+    # Whatever was still buffered is dropped, not sent late
+    assert "".join(stream) == ""
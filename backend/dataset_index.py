@@ -0,0 +1,352 @@
+"""Perceptual-hash index over a train/val image tree.
+
+Usage (run from backend/):
+    python dataset_index.py data/images/tomato                  # build / update the index
+    python dataset_index.py data/images/tomato --report dups.json
+    python dataset_index.py data/images/tomato --emit-lists     # write lists/train.csv, lists/val.csv
+    python dataset_index.py data/images/tomato --emit-lists --resplit 0.2
+
+The index lives at <root>/dataset_index.json and is updated incrementally:
+only files whose size or mtime changed since the last run are re-hashed.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+
+# ─── SETTINGS ────────────────────────────────────────────────────────────────
+SPLITS        = ("train", "val")
+IMAGE_EXTS    = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+INDEX_NAME    = "dataset_index.json"
+LISTS_DIR     = "lists"
+INDEX_VERSION = 1
+HASH_BITS     = 64
+THRESHOLD     = 4      # max Hamming distance between pHashes to call two images near-duplicates
+SAVE_EVERY    = 2000   # flush the index to disk every N newly hashed images
+
+# popcount lookup for uint8, used to count differing bits between hashes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# ─── HASHING (runs in worker processes) ──────────────────────────────────────
+def phash(gray: np.ndarray) -> int:
+    """64-bit DCT perceptual hash of a grayscale image."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype("float32")
+    dct = cv2.dct(small)[:8, :8].flatten()
+    # Ignore the DC term when taking the median so overall brightness doesn't dominate
+    bits = dct > np.median(dct[1:])
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hash_image(path: str):
+    """Return (path, entry) with hashes and basic stats, or (path, None) if unreadable."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return path, None
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        # Same green mask the detectors use for their healthy-leaf fallback
+        mask = cv2.inRange(hsv, (35, 50, 50), (85, 255, 255))
+
+        return path, {
+            "sha1":        hashlib.sha1(raw).hexdigest(),
+            "phash":       f"{phash(gray):016x}",
+            "width":       int(img.shape[1]),
+            "height":      int(img.shape[0]),
+            "mean":        round(float(gray.mean()), 2),
+            "std":         round(float(gray.std()), 2),
+            "green_ratio": round(float(np.count_nonzero(mask)) / mask.size, 4),
+            "sharpness":   round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 2),
+        }
+    except Exception as e:
+        print(f"Failed to hash {path}: {e}")
+        return path, None
+
+
+# ─── INDEX I/O ───────────────────────────────────────────────────────────────
+def index_path(root: str) -> str:
+    return os.path.join(root, INDEX_NAME)
+
+
+def load_index(root: str) -> dict:
+    fp = index_path(root)
+    if os.path.exists(fp):
+        with open(fp) as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION:
+            return index
+        print(f"Index version mismatch in {fp}, rebuilding")
+    return {"version": INDEX_VERSION, "entries": {}}
+
+
+def save_index(root: str, index: dict):
+    """Write atomically so an interrupted run never leaves a truncated index."""
+    fp = index_path(root)
+    tmp = fp + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, fp)
+
+
+def scan(root: str):
+    """Yield (relpath, split, label, size, mtime) for every image under <root>/<split>/<label>/."""
+    for split in SPLITS:
+        split_dir = os.path.join(root, split)
+        if not os.path.isdir(split_dir):
+            continue
+        for label in sorted(os.listdir(split_dir)):
+            label_dir = os.path.join(split_dir, label)
+            if not os.path.isdir(label_dir):
+                continue
+            for dirpath, _, files in os.walk(label_dir):
+                for fn in sorted(files):
+                    if os.path.splitext(fn)[1].lower() not in IMAGE_EXTS:
+                        continue
+                    fp = os.path.join(dirpath, fn)
+                    st = os.stat(fp)
+                    rel = os.path.relpath(fp, root).replace(os.sep, "/")
+                    yield rel, split, label, st.st_size, st.st_mtime
+
+
+def update_index(root: str, workers: int = None) -> dict:
+    """Hash new or changed images in parallel and drop entries for deleted files."""
+    index = load_index(root)
+    entries = index["entries"]
+
+    seen, todo = set(), {}
+    for rel, split, label, size, mtime in scan(root):
+        seen.add(rel)
+        old = entries.get(rel)
+        if old and old["size"] == size and old["mtime"] == mtime:
+            continue
+        todo[rel] = {"split": split, "label": label, "size": size, "mtime": mtime}
+
+    removed = [rel for rel in entries if rel not in seen]
+    for rel in removed:
+        del entries[rel]
+
+    print(f"Index: {len(seen)} images, {len(todo)} to hash, {len(removed)} removed")
+    if todo:
+        start = time.time()
+        paths = [os.path.join(root, rel) for rel in todo]
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, stats in pool.map(hash_image, paths, chunksize=32):
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                if stats is not None:
+                    entries[rel] = {**todo[rel], **stats}
+                done += 1
+                if done % SAVE_EVERY == 0:
+                    save_index(root, index)
+                    print(f"  hashed {done}/{len(todo)}")
+        print(f"Hashed {len(todo)} images in {time.time() - start:.1f}s")
+
+    if todo or removed:
+        save_index(root, index)
+    return index
+
+
+# ─── DUPLICATE SEARCH ────────────────────────────────────────────────────────
+def _hamming(a: int, others: np.ndarray) -> np.ndarray:
+    x = np.bitwise_xor(others, np.uint64(a))
+    return _POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def find_groups(entries: dict, threshold: int = THRESHOLD):
+    """Group images whose pHashes differ by at most `threshold` bits (or share a sha1).
+
+    Candidates come from multi-index hashing: the 64-bit hash is cut into
+    at least threshold+1 bands, and by the pigeonhole principle any two hashes within
+    `threshold` bits agree exactly on at least one band. Only images sharing a
+    band value are compared, which avoids an all-pairs scan.
+    """
+    keys = sorted(entries)
+    hashes = np.array([int(entries[k]["phash"], 16) for k in keys], dtype=np.uint64)
+
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    # Exact byte-for-byte copies
+    by_sha = {}
+    for i, k in enumerate(keys):
+        by_sha.setdefault(entries[k]["sha1"], []).append(i)
+    for members in by_sha.values():
+        for j in members[1:]:
+            union(members[0], j)
+
+    # Near duplicates
+    n_bands = next(b for b in (2, 4, 8, 16, 32, 64) if b > threshold)
+    width = HASH_BITS // n_bands
+    mask = np.uint64((1 << width) - 1)
+    for band in range(n_bands):
+        values = (hashes >> np.uint64(band * width)) & mask
+        order = np.argsort(values, kind="stable")
+        bounds = np.flatnonzero(np.diff(values[order])) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            bucket_hashes = hashes[bucket]
+            for pos in range(len(bucket) - 1):
+                dist = _hamming(int(bucket_hashes[pos]), bucket_hashes[pos + 1:])
+                for j in bucket[pos + 1:][dist <= threshold]:
+                    union(int(bucket[pos]), int(j))
+
+    groups = {}
+    for i, k in enumerate(keys):
+        groups.setdefault(find(i), []).append(k)
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+
+def build_report(entries: dict, groups: list) -> dict:
+    within, leaks, conflicts = [], [], []
+    for g in groups:
+        splits = {entries[k]["split"] for k in g}
+        labels = {entries[k]["label"] for k in g}
+        if len(splits) > 1:
+            leaks.append(g)
+        for s in splits:
+            if sum(entries[k]["split"] == s for k in g) > 1:
+                within.append([k for k in g if entries[k]["split"] == s])
+        if len(labels) > 1:
+            conflicts.append(g)
+
+    return {
+        "images":               len(entries),
+        "duplicate_groups":     len(groups),
+        "redundant_images":     sum(len(g) - 1 for g in groups),
+        "within_split":         within,
+        "cross_split_leaks":    leaks,
+        "label_conflicts":      conflicts,
+    }
+
+
+# ─── DEDUPLICATED, STRATIFIED LISTS ──────────────────────────────────────────
+def _representative(entries: dict, group: list) -> str:
+    """Keep the highest-resolution copy; break ties by path for stable output."""
+    return min(group, key=lambda k: (-entries[k]["width"] * entries[k]["height"], k))
+
+
+def build_lists(entries: dict, groups: list, resplit: float = None, seed: int = 42):
+    """Return {split: [(relpath, label), ...]} with one image per duplicate group.
+
+    Without `resplit` the existing train/val assignment is kept; a group that
+    leaks across splits is kept in train only. With `resplit` every group is
+    reassigned so that, per class, about that fraction lands in val. Groups
+    whose members disagree on the label are dropped.
+    """
+    grouped = {k for g in groups for k in g}
+    units = list(groups) + [[k] for k in sorted(entries) if k not in grouped]
+
+    lists = {s: [] for s in SPLITS}
+    by_label = {}
+    dropped = 0
+    for g in units:
+        labels = {entries[k]["label"] for k in g}
+        if len(labels) > 1:
+            dropped += 1
+            continue
+        label = labels.pop()
+        if resplit is not None:
+            by_label.setdefault(label, []).append(g)
+            continue
+        splits = {entries[k]["split"] for k in g}
+        split = "train" if "train" in splits else splits.pop()
+        rep = _representative(entries, [k for k in g if entries[k]["split"] == split])
+        lists[split].append((rep, label))
+
+    if resplit is not None:
+        rng = random.Random(seed)
+        for label in sorted(by_label):
+            units_for_label = by_label[label]
+            rng.shuffle(units_for_label)
+            n_val = int(round(len(units_for_label) * resplit))
+            for i, g in enumerate(units_for_label):
+                split = "val" if i < n_val else "train"
+                lists[split].append((_representative(entries, g), label))
+
+    if dropped:
+        print(f"Dropped {dropped} duplicate groups with conflicting labels")
+    for s in SPLITS:
+        lists[s].sort()
+    return lists
+
+
+def write_lists(root: str, lists: dict):
+    """Write <root>/lists/<split>.csv with `filename,class` columns (paths relative to root)."""
+    out_dir = os.path.join(root, LISTS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    for split, rows in lists.items():
+        fp = os.path.join(out_dir, f"{split}.csv")
+        with open(fp, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["filename", "class"])
+            w.writerows(rows)
+        counts = {}
+        for _, label in rows:
+            counts[label] = counts.get(label, 0) + 1
+        print(f"Wrote {len(rows)} rows to {fp}: {counts}")
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────────
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Index a train/val image tree and find duplicates.")
+    p.add_argument("root", help="dataset root containing train/ and val/, e.g. data/images/tomato")
+    p.add_argument("--workers", type=int, default=None, help="hashing processes (default: all cores)")
+    p.add_argument("--threshold", type=int, default=THRESHOLD, help="max pHash Hamming distance for near-duplicates")
+    p.add_argument("--report", help="write the full duplicate/leak report to this JSON file")
+    p.add_argument("--emit-lists", action="store_true", help="write deduplicated lists/train.csv and lists/val.csv")
+    p.add_argument("--resplit", type=float, default=None, help="reassign groups to val with this per-class fraction")
+    p.add_argument("--seed", type=int, default=42)
+    args = p.parse_args(argv)
+
+    if not 0 <= args.threshold < HASH_BITS:
+        p.error(f"--threshold must be between 0 and {HASH_BITS - 1}")
+    if args.resplit is not None and not 0 < args.resplit < 1:
+        p.error("--resplit must be between 0 and 1")
+
+    index = update_index(args.root, args.workers)
+    entries = index["entries"]
+    groups = find_groups(entries, args.threshold)
+    report = build_report(entries, groups)
+
+    print(f"Images: {report['images']}")
+    print(f"Duplicate groups: {report['duplicate_groups']} ({report['redundant_images']} redundant images)")
+    print(f"Within-split duplicate sets: {len(report['within_split'])}")
+    print(f"Train/val leaks: {len(report['cross_split_leaks'])}")
+    print(f"Groups with conflicting labels: {len(report['label_conflicts'])}")
+    for g in report["cross_split_leaks"][:10]:
+        print("  leak:", ", ".join(g))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved at: {args.report}")
+
+    if args.emit_lists:
+        write_lists(args.root, build_lists(entries, groups, args.resplit, args.seed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
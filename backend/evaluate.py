@@ -0,0 +1,457 @@
+"""Evaluate and compare model variants on a crop's validation split.
+
+Usage (run from backend/):
+    python evaluate.py tomato                                   # the promoted (LATEST) model
+    python evaluate.py tomato --variant base=latest \\
+        --variant int8=models/tomato/int8.tflite \\
+        --variant cascade=cascade:models/tomato/small.h5,latest@0.8
+    python evaluate.py tomato --variant cand=version:20261019-101500-tomato \\
+        --gate cand --min-accuracy 0.92 --max-latency-ms 120 --promote
+
+Variant specs:
+    latest                       promoted version from models/<crop>/LATEST
+    version:<name>               models/<crop>/<name>/model.h5
+    <path>.h5                    any Keras model (one or two image inputs)
+    <path>.tflite                exported / quantized TFLite model
+    cascade:<small>,<large>@<t>  run <small>; re-run images below confidence <t> through <large>
+
+Every image goes through the same preprocessing and healthy-leaf fallback as
+the API. Results are written to models/eval/<crop>-<timestamp>.json.
+"""
+import os
+import gc
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "api"))
+import model_registry  # noqa: E402
+from inference import preprocess_image, model_input, resolve_prediction  # noqa: E402
+
+# ─── SETTINGS ────────────────────────────────────────────────────────────────
+EVAL_DIR    = os.path.join(model_registry.MODEL_DIR, "eval")
+BATCH       = 64
+LOADERS     = 8      # threads decoding / preprocessing the next batch
+ECE_BINS    = 15
+SINGLE_RUNS = 20     # batch-of-1 calls used to measure serving latency
+IMAGE_EXTS  = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+
+CROPS = {
+    "banana": {"data_root": "data/images", "healthy": "Banana_Healthy",
+               "legacy": ("ensemble_disease_classifier.h5", "class_indices_banana.json")},
+    "tomato": {"data_root": "data/images/tomato", "healthy": "Tomato___healthy",
+               "legacy": ("tomato_ensemble_disease_classifier.h5", "class_indices_tomato.json")},
+}
+
+
+# ─── MEMORY ──────────────────────────────────────────────────────────────────
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+class PeakRSS:
+    """Sample resident memory in the background and keep the peak."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+# ─── VARIANTS ────────────────────────────────────────────────────────────────
+class KerasVariant:
+    def __init__(self, path: str):
+        self.path = path
+        self.model = tf.keras.models.load_model(path, compile=False)
+        self.n_inputs = len(self.model.inputs)
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        inputs = [x] * self.n_inputs if self.n_inputs > 1 else x
+        return self.model.predict_on_batch(inputs)
+
+
+class TFLiteVariant:
+    def __init__(self, path: str):
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=os.cpu_count())
+        self.batch = None
+
+    def _resize(self, batch: int):
+        for d in self.interpreter.get_input_details():
+            self.interpreter.resize_tensor_input(d["index"], [batch, *d["shape"][1:]])
+        self.interpreter.allocate_tensors()
+        self.batch = batch
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        if self.batch != len(x):
+            self._resize(len(x))
+        for d in self.interpreter.get_input_details():
+            value = x
+            scale, zero_point = d["quantization"]
+            if d["dtype"] in (np.uint8, np.int8) and scale:
+                value = np.round(x / scale + zero_point)
+            self.interpreter.set_tensor(d["index"], value.astype(d["dtype"]))
+        self.interpreter.invoke()
+        out = self.interpreter.get_output_details()[0]
+        probs = self.interpreter.get_tensor(out["index"])
+        scale, zero_point = out["quantization"]
+        if out["dtype"] in (np.uint8, np.int8) and scale:
+            probs = (probs.astype("float32") - zero_point) * scale
+        return probs.astype("float32")
+
+
+class CascadeVariant:
+    """Cheap model first; only low-confidence images are re-run through the large model."""
+
+    def __init__(self, small, large, threshold: float):
+        self.small, self.large, self.threshold = small, large, threshold
+        self.escalated = 0
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        probs = np.array(self.small.predict(x))
+        unsure = np.flatnonzero(probs.max(axis=1) < self.threshold)
+        if len(unsure):
+            probs[unsure] = self.large.predict(x[unsure])
+            self.escalated += len(unsure)
+        return probs
+
+
+def load_variant(spec: str, crop: str):
+    if spec.startswith("cascade:"):
+        body, _, threshold = spec[len("cascade:"):].rpartition("@")
+        small, large = body.split(",")
+        return CascadeVariant(load_variant(small, crop), load_variant(large, crop), float(threshold))
+    if spec == "latest" or spec.startswith("version:"):
+        version = model_registry.latest_version(crop) if spec == "latest" else spec.split(":", 1)[1]
+        if not version:
+            raise ValueError(f"No promoted {crop} model; train one or pass a path")
+        return KerasVariant(os.path.join(model_registry.version_dir(crop, version), model_registry.MODEL_NAME))
+    if spec.endswith(".tflite"):
+        return TFLiteVariant(spec)
+    return KerasVariant(spec)
+
+
+def variant_class_map(spec: str, crop: str, default_fp: str) -> dict:
+    """class → index map a variant was trained with.
+
+    Registry versions carry their own class_indices.json; a model file uses
+    one sitting next to it, else `default_fp` (what the API would load).
+    """
+    if spec.startswith("cascade:"):
+        small, large = spec[len("cascade:"):].rpartition("@")[0].split(",")
+        maps = variant_class_map(small, crop, default_fp), variant_class_map(large, crop, default_fp)
+        if maps[0] != maps[1]:
+            raise ValueError(f"Cascade stages use different class maps: {small} vs {large}")
+        return maps[0]
+    if spec == "latest" or spec.startswith("version:"):
+        version = model_registry.latest_version(crop) if spec == "latest" else spec.split(":", 1)[1]
+        if not version:
+            raise ValueError(f"No promoted {crop} model; train one or pass a path")
+        fp = os.path.join(model_registry.version_dir(crop, version), model_registry.INDICES_NAME)
+    else:
+        sibling = os.path.join(os.path.dirname(os.path.abspath(spec)), model_registry.INDICES_NAME)
+        fp = sibling if os.path.exists(sibling) else default_fp
+    with open(fp) as f:
+        return json.load(f)
+
+
+# ─── DATA ────────────────────────────────────────────────────────────────────
+def val_samples(data_root: str, cls2idx: dict):
+    """[(path, class_idx)] from lists/val.csv when dataset_index.py wrote one, else val/<class>/."""
+    list_fp = os.path.join(data_root, "lists", "val.csv")
+    samples = []
+    if os.path.exists(list_fp):
+        with open(list_fp) as f:
+            for row in csv.DictReader(f):
+                samples.append((os.path.join(data_root, row["filename"]), cls2idx[row["class"]]))
+        return samples
+
+    val_dir = os.path.join(data_root, "val")
+    for label in sorted(os.listdir(val_dir)):
+        if label not in cls2idx:
+            continue
+        for dirpath, _, files in os.walk(os.path.join(val_dir, label)):
+            for fn in sorted(files):
+                if os.path.splitext(fn)[1].lower() in IMAGE_EXTS:
+                    samples.append((os.path.join(dirpath, fn), cls2idx[label]))
+    return samples
+
+
+def _load(path):
+    original, enhanced = preprocess_image(path)
+    return original, model_input(enhanced)
+
+
+def stream_batches(samples, batch: int, pool: ThreadPoolExecutor):
+    """Yield (originals, inputs, labels, preprocess_seconds) while the next batch loads in the background."""
+    chunks = [samples[i:i + batch] for i in range(0, len(samples), batch)]
+
+    def load_chunk(chunk):
+        start = time.perf_counter()
+        loaded = list(pool.map(_load, [p for p, _ in chunk]))
+        return ([o for o, _ in loaded], np.stack([x for _, x in loaded]),
+                np.array([y for _, y in chunk]), time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        pending = prefetch.submit(load_chunk, chunks[0]) if chunks else None
+        for nxt in chunks[1:] + [None]:
+            result = pending.result()
+            pending = prefetch.submit(load_chunk, nxt) if nxt is not None else None
+            yield result
+
+
+# ─── METRICS ─────────────────────────────────────────────────────────────────
+def confusion(y_true, y_pred, n: int) -> np.ndarray:
+    m = np.zeros((n, n), dtype=int)
+    np.add.at(m, (y_true, y_pred), 1)
+    return m
+
+
+def calibration(probs: np.ndarray, y_true: np.ndarray, bins: int = ECE_BINS) -> dict:
+    conf = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == y_true
+    edges = np.linspace(0, 1, bins + 1)
+    ece, table = 0.0, []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        sel = (conf > lo) & (conf <= hi)
+        if not sel.any():
+            continue
+        gap = abs(correct[sel].mean() - conf[sel].mean())
+        ece += sel.mean() * gap
+        table.append({"bin": [round(lo, 3), round(hi, 3)], "count": int(sel.sum()),
+                      "accuracy": float(correct[sel].mean()), "confidence": float(conf[sel].mean())})
+    onehot = np.eye(probs.shape[1])[y_true]
+    return {
+        "ece": float(ece),
+        "brier": float(np.mean(np.sum((probs - onehot) ** 2, axis=1))),
+        "nll": float(-np.mean(np.log(np.clip(probs[np.arange(len(y_true)), y_true], 1e-12, 1)))),
+        "reliability": table,
+    }
+
+
+def per_class(matrix: np.ndarray, idx2cls: dict) -> dict:
+    out = {}
+    for i in range(len(matrix)):
+        tp = matrix[i, i]
+        support = matrix[i].sum()
+        predicted = matrix[:, i].sum()
+        out[idx2cls[i]] = {
+            "support": int(support),
+            "precision": float(tp / predicted) if predicted else 0.0,
+            "recall": float(tp / support) if support else 0.0,
+        }
+    return out
+
+
+# ─── EVALUATION ──────────────────────────────────────────────────────────────
+def evaluate_variant(spec, crop, samples, cls2idx, idx2cls, batch):
+    healthy = CROPS[crop]["healthy"]
+    gc.collect()
+    base_rss = rss_mb()
+
+    start = time.perf_counter()
+    variant = load_variant(spec, crop)
+    load_s = time.perf_counter() - start
+    load_rss = rss_mb()
+
+    all_probs, served, labels, overrides = [], [], [], []
+    batch_ms, preprocess_s, fallback_s = [], 0.0, 0.0
+    with PeakRSS() as mem, ThreadPoolExecutor(max_workers=LOADERS) as pool:
+        wall = time.perf_counter()
+        # Warm-up call so graph tracing isn't billed to the first batch
+        if samples:
+            variant.predict(np.expand_dims(_load(samples[0][0])[1], 0))
+        for originals, x, y, prep in stream_batches(samples, batch, pool):
+            preprocess_s += prep
+            t = time.perf_counter()
+            probs = np.asarray(variant.predict(x))
+            batch_ms.append((time.perf_counter() - t) * 1000 / len(x))
+
+            t = time.perf_counter()
+            for p, original in zip(probs, originals):
+                idx, overridden = resolve_prediction(p, original, cls2idx, idx2cls, healthy, verbose=False)
+                served.append(idx)
+                overrides.append(overridden)
+            fallback_s += time.perf_counter() - t
+            all_probs.append(probs)
+            labels.append(y)
+        wall = time.perf_counter() - wall
+
+        # Serving latency: the API runs one image per request
+        single_ms = []
+        for path, _ in samples[:SINGLE_RUNS]:
+            t = time.perf_counter()
+            original, x = _load(path)
+            p = np.asarray(variant.predict(np.expand_dims(x, 0)))[0]
+            resolve_prediction(p, original, cls2idx, idx2cls, healthy, verbose=False)
+            single_ms.append((time.perf_counter() - t) * 1000)
+
+    probs = np.concatenate(all_probs) if all_probs else np.zeros((0, len(cls2idx)))
+    y_true = np.concatenate(labels) if labels else np.zeros(0, dtype=int)
+    raw = probs.argmax(axis=1)
+    served = np.array(served, dtype=int)
+    overrides = np.array(overrides, dtype=bool)
+    n = max(len(y_true), 1)
+    matrix = confusion(y_true, served, len(cls2idx))
+
+    result = {
+        "spec": spec,
+        "images": int(len(y_true)),
+        "accuracy": float((served == y_true).sum() / n),
+        "raw_accuracy": float((raw == y_true).sum() / n),
+        "fallback": {
+            "overrides": int(overrides.sum()),
+            "fixed": int((overrides & (raw != y_true) & (served == y_true)).sum()),
+            "broken": int((overrides & (raw == y_true) & (served != y_true)).sum()),
+        },
+        "per_class": per_class(matrix, idx2cls),
+        "confusion_matrix": matrix.tolist(),
+        "calibration": calibration(probs, y_true) if len(y_true) else {},
+        "latency": {
+            "model_ms_per_image": float(np.mean(batch_ms)) if batch_ms else None,
+            "preprocess_ms_per_image": preprocess_s * 1000 / n,
+            "fallback_ms_per_image": fallback_s * 1000 / n,
+            "single_ms_p50": float(np.percentile(single_ms, 50)) if single_ms else None,
+            "single_ms_p95": float(np.percentile(single_ms, 95)) if single_ms else None,
+            "throughput_ips": float(len(y_true) / wall) if wall else None,
+            "load_s": load_s,
+        },
+        "memory_mb": {
+            "model": load_rss - base_rss,
+            "peak": mem.peak - base_rss,
+        },
+    }
+    if isinstance(variant, CascadeVariant):
+        result["cascade_escalated"] = variant.escalated
+
+    del variant
+    tf.keras.backend.clear_session()
+    gc.collect()
+    return result
+
+
+def print_table(results: dict):
+    cols = [("accuracy", "acc"), ("raw_accuracy", "raw"), ("ece", "ece"), ("model_ms", "ms/img"),
+            ("p95", "p95 1-img"), ("ips", "img/s"), ("mem", "peak MB"), ("overrides", "fallback +/-")]
+    print("\n" + "variant".ljust(16) + "".join(h.rjust(14) for _, h in cols))
+    for name, r in results.items():
+        lat = r["latency"]
+        fb = r["fallback"]
+        row = [
+            f"{r['accuracy']:.2%}", f"{r['raw_accuracy']:.2%}", f"{r['calibration'].get('ece', 0):.3f}",
+            f"{lat['model_ms_per_image'] or 0:.2f}", f"{lat['single_ms_p95'] or 0:.1f}",
+            f"{lat['throughput_ips'] or 0:.1f}", f"{r['memory_mb']['peak']:.0f}",
+            f"{fb['fixed']}/{fb['broken']}",
+        ]
+        print(name[:16].ljust(16) + "".join(v.rjust(14) for v in row))
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────────
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Evaluate model variants on the validation split.")
+    p.add_argument("crop", choices=sorted(CROPS))
+    p.add_argument("--variant", action="append", default=[], metavar="NAME=SPEC",
+                   help="variant to evaluate (repeatable); default: latest=latest")
+    p.add_argument("--data-root", help="dataset root containing val/ (default depends on crop)")
+    p.add_argument("--batch", type=int, default=BATCH)
+    p.add_argument("--limit", type=int, help="evaluate only the first N images")
+    p.add_argument("--out", help="results file (default: models/eval/<crop>-<timestamp>.json)")
+    p.add_argument("--gate", metavar="NAME", help="variant that must pass --min-accuracy/--max-latency-ms")
+    p.add_argument("--min-accuracy", type=float)
+    p.add_argument("--max-latency-ms", type=float, help="limit on the single-image p95 latency")
+    p.add_argument("--promote", action="store_true", help="promote the gated variant if it passes (version: specs only)")
+    args = p.parse_args(argv)
+
+    crop_cfg = CROPS[args.crop]
+    variants = dict(v.split("=", 1) for v in args.variant) or {"latest": "latest"}
+    if args.gate and args.gate not in variants:
+        p.error(f"--gate {args.gate} is not one of the variants")
+
+    legacy_model, legacy_idx = (os.path.join(model_registry.MODEL_DIR, f) for f in crop_cfg["legacy"])
+    _, default_idx = model_registry.resolve(args.crop, legacy_model, legacy_idx)
+    # Every variant must be scored with the labels it was trained on, and compared on the same ones
+    try:
+        class_maps = {name: variant_class_map(spec, args.crop, default_idx) for name, spec in variants.items()}
+    except (OSError, ValueError) as e:
+        p.error(str(e))
+    cls2idx = next(iter(class_maps.values()))
+    differing = [name for name, m in class_maps.items() if m != cls2idx]
+    if differing:
+        p.error(f"Variants use different class maps and can't be compared: "
+                f"{', '.join(differing)} vs {next(iter(class_maps))}")
+    idx2cls = {v: k for k, v in cls2idx.items()}
+
+    data_root = os.path.join(BASE_DIR, args.data_root or crop_cfg["data_root"])
+    samples = val_samples(data_root, cls2idx)[:args.limit]
+    print(f"Evaluating {len(variants)} variant(s) on {len(samples)} images from {data_root}")
+
+    results = {}
+    for name, spec in variants.items():
+        print(f"→ {name}: {spec}")
+        results[name] = evaluate_variant(spec, args.crop, samples, cls2idx, idx2cls, args.batch)
+    print_table(results)
+
+    report = {
+        "crop": args.crop,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "data_root": data_root,
+        "class_indices": cls2idx,
+        "variants": results,
+    }
+
+    status = 0
+    if args.gate:
+        r = results[args.gate]
+        failures = []
+        if args.min_accuracy is not None and r["accuracy"] < args.min_accuracy:
+            failures.append(f"accuracy {r['accuracy']:.4f} < {args.min_accuracy}")
+        p95 = r["latency"]["single_ms_p95"]
+        if args.max_latency_ms is not None and (p95 is None or p95 > args.max_latency_ms):
+            failures.append(f"p95 latency {p95} ms > {args.max_latency_ms} ms")
+        report["gate"] = {"variant": args.gate, "passed": not failures, "failures": failures}
+        if failures:
+            print(f"Gate failed for {args.gate}: " + "; ".join(failures))
+            status = 1
+        else:
+            print(f"Gate passed for {args.gate}")
+            spec = variants[args.gate]
+            if args.promote and spec.startswith("version:"):
+                with model_registry.promotion_lock(args.crop):
+                    model_registry.promote(args.crop, spec.split(":", 1)[1])
+            elif args.promote:
+                print("Only version:<name> variants can be promoted")
+
+    out = args.out or os.path.join(EVAL_DIR, f"{args.crop}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved at: {out}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,464 @@
+"""Single training entry point for every crop / hyperparameter config.
+
+Usage (run from backend/):
+    python train.py                              # run every job in train_config.json
+    python train.py --job tomato                 # run one job in this process
+    python train.py --config sweep.json --max-cpus 8
+    python train.py --job banana --fresh         # discard saved state and start over
+
+Each job checkpoints weights, optimizer state, epoch, phase and callback
+counters to runs/<job>/ after every epoch and resumes from there when it is
+started again. Finished models are written to models/<crop>/<version>/ and
+promoted to models/<crop>/LATEST, which is what the API loads.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "api"))
+import model_registry  # noqa: E402
+
+# ─── SETTINGS ────────────────────────────────────────────────────────────────
+CONFIG_FP = os.path.join(BASE_DIR, "train_config.json")
+RUNS_DIR  = os.path.join(BASE_DIR, "runs")
+STATE_NAME = "state.json"
+EXIT_PERMANENT = 2   # job exit code for failures a retry can't fix (changed config, bad arguments)
+
+DEFAULTS = {
+    "img_size": [224, 224],
+    "batch": 24,
+    "epochs": 45,            # total epochs across both phases
+    "phase1_epochs": 15,     # epochs with the pre-trained bases frozen
+    "fine_tune_layers": 45,  # layers unfrozen at the top of each base in phase 2
+    "lr": 1e-4,
+    "fine_tune_lr": 2e-5,
+    "seed": 42,
+    "cpus": 4,               # cores reserved by the scheduler (and TF thread pools)
+    "memory_gb": 6,          # memory reserved by the scheduler
+    "max_retries": 1,        # failed jobs are restarted and resume from their last epoch
+    "promote": True,         # point models/<crop>/LATEST at the new version if it is at least as good
+}
+
+
+# ─── CONFIG ──────────────────────────────────────────────────────────────────
+def load_jobs(config_fp: str) -> list:
+    with open(config_fp) as f:
+        config = json.load(f)
+    defaults = {**DEFAULTS, **config.get("defaults", {})}
+
+    jobs, names = [], set()
+    for raw in config.get("jobs", []):
+        job = {**defaults, **raw}
+        for key in ("name", "crop", "data_root"):
+            if not job.get(key):
+                raise ValueError(f"Job {raw} is missing '{key}'")
+        if job["name"] in names:
+            raise ValueError(f"Duplicate job name '{job['name']}'")
+        if not 0 <= job["phase1_epochs"] <= job["epochs"]:
+            raise ValueError(f"Job '{job['name']}': phase1_epochs must be between 0 and epochs")
+        names.add(job["name"])
+        jobs.append(job)
+    return jobs
+
+
+# ─── RUN STATE ───────────────────────────────────────────────────────────────
+def load_state(run_dir: str):
+    fp = os.path.join(run_dir, STATE_NAME)
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as f:
+        return json.load(f)
+
+
+def save_state(run_dir: str, state: dict):
+    fp = os.path.join(run_dir, STATE_NAME)
+    tmp = fp + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, fp)
+
+
+def clear_state(run_dir: str):
+    """Drop saved state and checkpoints, keeping the run directory (and the scheduler's train.log in it)."""
+    if not os.path.isdir(run_dir):
+        os.makedirs(run_dir)
+        return
+    for name in os.listdir(run_dir):
+        fp = os.path.join(run_dir, name)
+        if name.startswith("phase") and os.path.isdir(fp):
+            shutil.rmtree(fp, ignore_errors=True)
+        elif name in (STATE_NAME, STATE_NAME + ".tmp", "early_stopping_best.npz", "best_ensemble_model.h5"):
+            os.remove(fp)
+
+
+def new_state(job: dict) -> dict:
+    return {
+        "job": job,
+        "status": "running",
+        "phase": 1,
+        "epoch": 0,           # next epoch to run (Keras initial_epoch)
+        "lr": None,
+        "monitors": {},       # EarlyStopping / ReduceLROnPlateau counters for the current phase
+        "best_val_accuracy": None,
+        "version": None,
+    }
+
+
+# ─── DATA & MODEL (TensorFlow is only imported inside training workers) ──────
+def make_sequences(job: dict):
+    """Return (train_seq, val_seq, class_indices), preferring dataset_index.py lists when present."""
+    import pandas as pd
+    from tensorflow.keras.applications.efficientnet import preprocess_input as eff_preprocess
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    from tensorflow.keras.utils import Sequence
+
+    # Custom data loader to send the same input to both models
+    class DualInputSequence(Sequence):
+        def __init__(self, generator):
+            self.generator = generator
+
+        def __len__(self):
+            return len(self.generator)
+
+        def __getitem__(self, index):
+            x, y = self.generator[index]
+            return (x, x), y  # must return tuple not list
+
+        def on_epoch_end(self):
+            self.generator.on_epoch_end()
+
+    root = os.path.join(BASE_DIR, job["data_root"])
+    train_dir = os.path.join(root, "train")
+    val_dir = os.path.join(root, "val")
+    list_dir = os.path.join(root, "lists")
+    img_size = tuple(job["img_size"])
+
+    train_datagen = ImageDataGenerator(
+        preprocessing_function=eff_preprocess,
+        rotation_range=25,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        brightness_range=[0.8, 1.2],
+        fill_mode='nearest'
+    )
+    val_datagen = ImageDataGenerator(preprocessing_function=eff_preprocess)
+    common = dict(target_size=img_size, batch_size=job["batch"], class_mode='categorical')
+
+    if os.path.exists(os.path.join(list_dir, "train.csv")):
+        classes = sorted(d for d in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, d)))
+        print(f"Using file lists from {list_dir}")
+        frame = dict(directory=root, x_col="filename", y_col="class", classes=classes, **common)
+        train_gen = train_datagen.flow_from_dataframe(
+            pd.read_csv(os.path.join(list_dir, "train.csv")), shuffle=True, seed=job["seed"], **frame)
+        val_gen = val_datagen.flow_from_dataframe(
+            pd.read_csv(os.path.join(list_dir, "val.csv")), shuffle=False, **frame)
+    else:
+        train_gen = train_datagen.flow_from_directory(train_dir, shuffle=True, seed=job["seed"], **common)
+        val_gen = val_datagen.flow_from_directory(val_dir, shuffle=False, **common)
+
+    return DualInputSequence(train_gen), DualInputSequence(val_gen), train_gen.class_indices
+
+
+def build_model(job: dict, n_classes: int):
+    """EfficientNetB2 + MobileNetV2 branches averaged into one ensemble. Returns (model, bases)."""
+    from tensorflow.keras.applications import EfficientNetB2, MobileNetV2
+    from tensorflow.keras.layers import GlobalAveragePooling2D, BatchNormalization, Dense, Dropout, Average
+    from tensorflow.keras.models import Model
+
+    def build_branch(base_model_fn, name):
+        base = base_model_fn(weights="imagenet", include_top=False, input_shape=(*job["img_size"], 3))
+        base.trainable = False
+        x = base.output
+        x = GlobalAveragePooling2D()(x)
+        x = BatchNormalization()(x)
+        x = Dense(448, activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = Dropout(0.4)(x)
+        x = Dense(224, activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = Dropout(0.3)(x)
+        out = Dense(n_classes, activation='softmax', name=name)(x)
+        return base.input, out, base
+
+    eff_input, eff_output, eff_base = build_branch(EfficientNetB2, "EffNet_Output")
+    mob_input, mob_output, mob_base = build_branch(MobileNetV2, "MobNet_Output")
+    combined_output = Average()([eff_output, mob_output])
+    return Model(inputs=[eff_input, mob_input], outputs=combined_output), (eff_base, mob_base)
+
+
+def make_resume_callback(run_dir, state, manager, early_stopping, reduce_lr, best_checkpoint):
+    import tensorflow as tf
+
+    es_weights_fp = os.path.join(run_dir, "early_stopping_best.npz")
+
+    class ResumeState(tf.keras.callbacks.Callback):
+        """Persist epoch, LR and callback counters after every epoch; restore them on resume.
+
+        Must come last in the callback list: its on_train_begin has to run after
+        EarlyStopping/ReduceLROnPlateau reset themselves.
+        """
+
+        def on_train_begin(self, logs=None):
+            m = state["monitors"]
+            if not m:
+                return
+            early_stopping.wait, early_stopping.best = m["es_wait"], m["es_best"]
+            reduce_lr.wait, reduce_lr.best = m["rlr_wait"], m["rlr_best"]
+            reduce_lr.cooldown_counter = m["rlr_cooldown"]
+            if os.path.exists(es_weights_fp):
+                with np.load(es_weights_fp) as data:
+                    early_stopping.best_weights = [data[f"arr_{i}"] for i in range(len(data.files))]
+
+        def on_epoch_end(self, epoch, logs=None):
+            if early_stopping.wait == 0 and early_stopping.best_weights is not None:
+                np.savez(es_weights_fp, *early_stopping.best_weights)
+            manager.save(checkpoint_number=epoch + 1)
+            state.update(
+                epoch=epoch + 1,
+                lr=float(tf.keras.backend.get_value(self.model.optimizer.learning_rate)),
+                best_val_accuracy=float(best_checkpoint.best),
+                monitors={
+                    "es_wait": early_stopping.wait,
+                    "es_best": float(early_stopping.best),
+                    "rlr_wait": reduce_lr.wait,
+                    "rlr_best": float(reduce_lr.best),
+                    "rlr_cooldown": reduce_lr.cooldown_counter,
+                },
+            )
+            save_state(run_dir, state)
+
+    return ResumeState()
+
+
+# ─── TRAINING WORKER ─────────────────────────────────────────────────────────
+def train_job(job: dict, fresh: bool = False) -> int:
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
+
+    tf.config.threading.set_intra_op_parallelism_threads(job["cpus"])
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, job["cpus"] // 2))
+    for gpu in tf.config.list_physical_devices("GPU"):
+        # Concurrent jobs share the GPU instead of each grabbing all of its memory
+        tf.config.experimental.set_memory_growth(gpu, True)
+
+    run_dir = os.path.join(RUNS_DIR, job["name"])
+    state = None if fresh else load_state(run_dir)
+    if state is not None and state["job"] != job:
+        print(f"Config for '{job['name']}' changed since the saved run; use --fresh to start over")
+        return EXIT_PERMANENT
+    if state is None:
+        clear_state(run_dir)
+        state = new_state(job)
+        save_state(run_dir, state)
+    elif state["status"] == "done":
+        print(f"Job '{job['name']}' already finished (version {state['version']})")
+        return 0
+    else:
+        print(f"Resuming '{job['name']}' at phase {state['phase']}, epoch {state['epoch']}")
+
+    tf.random.set_seed(job["seed"])
+    np.random.seed(job["seed"])
+
+    train_seq, val_seq, class_indices = make_sequences(job)
+    model, bases = build_model(job, len(class_indices))
+
+    early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
+    reduce_lr = ReduceLROnPlateau(monitor='val_loss', factor=0.6, patience=5, min_lr=5e-7)
+    best_checkpoint = ModelCheckpoint(
+        filepath=os.path.join(run_dir, 'best_ensemble_model.h5'),
+        monitor='val_accuracy',
+        save_best_only=True,
+        initial_value_threshold=state["best_val_accuracy"],
+        verbose=1
+    )
+
+    phases = [
+        (1, job["lr"], job["phase1_epochs"]),
+        (2, job["fine_tune_lr"], job["epochs"]),
+    ]
+    for phase, lr, end_epoch in phases:
+        if phase == 2:
+            for base in bases:
+                for layer in base.layers[-job["fine_tune_layers"]:]:
+                    layer.trainable = True
+        if state["phase"] > phase:
+            continue
+
+        optimizer = tf.keras.optimizers.Adam(lr)
+        model.compile(optimizer=optimizer, loss="categorical_crossentropy", metrics=["accuracy"])
+        ckpt = tf.train.Checkpoint(model=model, optimizer=optimizer)
+        manager = tf.train.CheckpointManager(ckpt, os.path.join(run_dir, f"phase{phase}"), max_to_keep=2)
+
+        if manager.latest_checkpoint:
+            ckpt.restore(manager.latest_checkpoint)
+            if state["lr"] is not None:
+                tf.keras.backend.set_value(optimizer.learning_rate, state["lr"])
+        elif phase == 2 and state["epoch"] > 0:
+            # Resumed straight into phase 2: carry the final phase 1 weights over
+            prev = tf.train.latest_checkpoint(os.path.join(run_dir, "phase1"))
+            if prev:
+                tf.train.Checkpoint(model=model).restore(prev).expect_partial()
+
+        print(f"Phase {phase}: epochs {state['epoch']}–{end_epoch} ({'top layers' if phase == 1 else 'fine-tuning'})")
+        resume = make_resume_callback(run_dir, state, manager, early_stopping, reduce_lr, best_checkpoint)
+        model.fit(
+            train_seq,
+            validation_data=val_seq,
+            initial_epoch=state["epoch"],
+            epochs=end_epoch,
+            callbacks=[early_stopping, reduce_lr, best_checkpoint, resume],
+            verbose=1
+        )
+
+        # Phase finished (possibly stopped early): save the weights EarlyStopping settled on
+        manager.save(checkpoint_number=end_epoch + 1)
+        state.update(phase=phase + 1, epoch=end_epoch, lr=None, monitors={})
+        save_state(run_dir, state)
+
+    val_loss, val_accuracy = model.evaluate(val_seq, verbose=1)
+    version = publish(job, model, class_indices, {"val_loss": float(val_loss), "val_accuracy": float(val_accuracy)})
+    state.update(status="done", version=version)
+    save_state(run_dir, state)
+    return 0
+
+
+def publish(job: dict, model, class_indices: dict, metrics: dict) -> str:
+    """Write a versioned artifact set and promote it if it is at least as good as the current one."""
+    crop = job["crop"]
+    version = model_registry.new_version(job["name"])
+    out_dir = model_registry.version_dir(crop, version)
+    os.makedirs(out_dir, exist_ok=True)
+
+    model.save(os.path.join(out_dir, model_registry.MODEL_NAME))
+    with open(os.path.join(out_dir, model_registry.INDICES_NAME), "w") as f:
+        json.dump(class_indices, f)
+    with open(os.path.join(out_dir, model_registry.METADATA_NAME), "w") as f:
+        json.dump({"job": job, "metrics": metrics, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=2)
+    print(f"{crop} ensemble model saved at: {out_dir} ({metrics})")
+
+    if job["promote"]:
+        # Jobs for the same crop can finish together: compare and promote under one lock
+        with model_registry.promotion_lock(crop):
+            current = model_registry.latest_version(crop)
+            current_acc = model_registry.read_metadata(crop, current).get("metrics", {}).get("val_accuracy", -1) if current else -1
+            if metrics["val_accuracy"] >= current_acc:
+                model_registry.promote(crop, version)
+            else:
+                print(f"Not promoting {version}: val_accuracy {metrics['val_accuracy']:.4f} < {current_acc:.4f} ({current})")
+    return version
+
+
+# ─── SCHEDULER ───────────────────────────────────────────────────────────────
+def total_memory_gb() -> float:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+
+
+def available_memory_gb() -> float:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return total_memory_gb()
+
+
+def run_all(jobs: list, config_fp: str, max_cpus: int, max_memory_gb: float, fresh: bool) -> int:
+    """Run jobs as subprocesses, starting each one only when its cores and memory are free.
+
+    Jobs are considered in config order and any job that fits is started
+    (first fit), so a small job can run beside a large one. A job larger than
+    the whole budget still runs, alone.
+    """
+    pending = list(jobs)
+    attempts = {job["name"]: 0 for job in jobs}
+    running, failed = {}, []
+
+    while pending or running:
+        for job in list(pending):
+            cpus_used = sum(j["cpus"] for j, _ in running.values())
+            mem_used = sum(j["memory_gb"] for j, _ in running.values())
+            fits = (
+                cpus_used + job["cpus"] <= max_cpus and
+                mem_used + job["memory_gb"] <= max_memory_gb and
+                job["memory_gb"] <= available_memory_gb()
+            )
+            if not fits and running:
+                continue
+
+            pending.remove(job)
+            attempts[job["name"]] += 1
+            run_dir = os.path.join(RUNS_DIR, job["name"])
+            os.makedirs(run_dir, exist_ok=True)
+            env = dict(os.environ)
+            env.update({
+                "OMP_NUM_THREADS": str(job["cpus"]),
+                "TF_NUM_INTRAOP_THREADS": str(job["cpus"]),
+                "TF_NUM_INTEROP_THREADS": str(max(1, job["cpus"] // 2)),
+            })
+            cmd = [sys.executable, os.path.abspath(__file__), "--config", config_fp, "--job", job["name"]]
+            if fresh and attempts[job["name"]] == 1:
+                cmd.append("--fresh")
+            log = open(os.path.join(run_dir, "train.log"), "a")
+            proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+            log.close()
+            running[job["name"]] = (job, proc)
+            print(f"Started '{job['name']}' (pid {proc.pid}, {job['cpus']} cpus, {job['memory_gb']} GB), log: {run_dir}/train.log")
+
+        time.sleep(2)
+        for name, (job, proc) in list(running.items()):
+            code = proc.poll()
+            if code is None:
+                continue
+            del running[name]
+            if code == 0:
+                print(f"Finished '{name}'")
+            elif code != EXIT_PERMANENT and attempts[name] <= job["max_retries"]:
+                print(f"'{name}' exited with {code}, retrying from its last checkpoint")
+                pending.append(job)
+            else:
+                print(f"'{name}' failed with exit code {code}")
+                failed.append(name)
+
+    if failed:
+        print(f"Failed jobs: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+# ─── CLI ─────────────────────────────────────────────────────────────────────
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Train crop disease ensembles from a config file.")
+    p.add_argument("--config", default=CONFIG_FP, help="job config (default: train_config.json)")
+    p.add_argument("--job", help="run only this job, in this process")
+    p.add_argument("--max-cpus", type=int, default=os.cpu_count(), help="cores the scheduler may hand out")
+    p.add_argument("--max-memory-gb", type=float, default=None, help="memory the scheduler may hand out (default: 90%% of RAM)")
+    p.add_argument("--fresh", action="store_true", help="ignore saved state and start from scratch")
+    args = p.parse_args(argv)
+
+    config_fp = os.path.abspath(args.config)
+    jobs = load_jobs(config_fp)
+
+    if args.job:
+        matches = [j for j in jobs if j["name"] == args.job]
+        if not matches:
+            p.error(f"No job named '{args.job}' in {config_fp}")
+        return train_job(matches[0], fresh=args.fresh)
+
+    max_memory = args.max_memory_gb or total_memory_gb() * 0.9
+    return run_all(jobs, config_fp, args.max_cpus, max_memory, args.fresh)
+
+
+if __name__ == "__main__":
+    sys.exit(main())